@@ -0,0 +1,133 @@
+"""
+Admission control for model requests.
+
+Two gates sit in front of OpenRouter. Per channel, turns queue FIFO behind
+the channel lock, and once `max_queue` turns are queued or running further
+messages are turned away with `Busy` instead of piling up. Globally, a
+resizable semaphore (sized to the key pool) bounds how many model requests
+are in flight at once, so a burst across channels waits its turn rather
+than tripping 429s on every key together. Time spent waiting at either
+gate is tracked separately from time spent on the model.
+"""
+
+import asyncio
+import contextlib
+import time
+from collections import deque
+
+
+class Busy(Exception):
+    """The channel's queue is full."""
+
+
+class _Timing:
+    __slots__ = ("count", "total", "max")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def __str__(self):
+        avg = self.total / self.count if self.count else 0.0
+        return f"avg {avg:.2f}s, max {self.max:.2f}s over {self.count}"
+
+
+class Admission:
+    """Per-channel FIFO queues with a depth limit, plus a global model semaphore."""
+
+    def __init__(self, limit: int = 2, max_queue: int = 3):
+        self.limit = max(1, limit)
+        self.max_queue = max(1, max_queue)
+        self._active = 0
+        self._waiters = deque()     # futures waiting for a model slot, oldest first
+        self._depth = {}            # channel id -> turns queued or running
+        self.rejected = 0
+        self.queue_wait = _Timing()
+        self.slot_wait = _Timing()
+        self.model_time = _Timing()
+
+    def resize(self, limit: int):
+        """Change the number of model slots; waiters are admitted if it grew."""
+        self.limit = max(1, limit)
+        self._wake()
+
+    @contextlib.asynccontextmanager
+    async def channel(self, channel, lock: asyncio.Lock):
+        """
+        Hold the channel's turn: wait FIFO behind `lock`, or raise Busy at
+        once when `max_queue` turns are already queued or running.
+        """
+        depth = self._depth.get(channel.id, 0)
+        if depth >= self.max_queue:
+            self.rejected += 1
+            raise Busy(depth)
+        self._depth[channel.id] = depth + 1
+        try:
+            start = time.monotonic()
+            async with lock:
+                self.queue_wait.add(time.monotonic() - start)
+                yield
+        finally:
+            remaining = self._depth[channel.id] - 1
+            if remaining:
+                self._depth[channel.id] = remaining
+            else:
+                del self._depth[channel.id]
+
+    @contextlib.asynccontextmanager
+    async def model_slot(self):
+        """Hold one of the global model slots for the duration of a request."""
+        start = time.monotonic()
+        if self._active >= self.limit or self._waiters:
+            future = asyncio.get_running_loop().create_future()
+            self._waiters.append(future)
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    # Woken and cancelled in the same tick: pass the slot on
+                    self._active -= 1
+                    self._wake()
+                else:
+                    self._waiters.remove(future)
+                raise
+        else:
+            self._active += 1
+
+        admitted = time.monotonic()
+        self.slot_wait.add(admitted - start)
+        try:
+            yield
+        finally:
+            self.model_time.add(time.monotonic() - admitted)
+            self._active -= 1
+            self._wake()
+
+    def _wake(self):
+        while self._waiters and self._active < self.limit:
+            future = self._waiters.popleft()
+            if not future.done():
+                self._active += 1
+                future.set_result(None)
+
+    def queued(self) -> int:
+        """Turns queued or running across all channels."""
+        return sum(self._depth.values())
+
+    def summary(self) -> list:
+        """Slot and queue usage, turned-away turns and wait times."""
+        return [
+            f"Model slots: {self._active}/{self.limit} in use, {len(self._waiters)} waiting",
+            f"Channel turns queued or running: {self.queued()} in {len(self._depth)} channels "
+            f"(max {self.max_queue} per channel)",
+            f"Turned away as busy: {self.rejected}",
+            f"Channel queue wait: {self.queue_wait}",
+            f"Model slot wait: {self.slot_wait}",
+            f"Model time: {self.model_time}",
+        ]
@@ -1,16 +1,39 @@
 import discord
 from redbot.core import commands, Config
+from redbot.core.data_manager import cog_data_path
 import aiohttp
 import re
 from collections import Counter
 from itertools import islice
 import os
 import asyncio
-import urllib.request
+import contextlib
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from html.parser import HTMLParser
-from datetime import datetime
-import difflib
+from datetime import datetime, timedelta
 import json
+import logging
+import time
+from .index import NameIndex, SearchCancelled
+from .filecache import FileCache, content_hash
+from .httpclient import HttpStats, make_session
+from .streaming import MessageStreamer, iter_sse_deltas
+from .replycache import ReplyCache
+from .rendercache import RenderCache
+from . import markup
+from .convstore import ConversationStore
+from .prompt import PromptStats, fit_context, has_story, is_summary
+from .keypool import KeyPool, mask_key, parse_retry_after
+from .admission import Admission, Busy
+from .records import deep_sizeof, load_records, source_rank
+from . import intent
+from .localdata import LocalBundle, local_path
+from .spans import Tracer, detach_turn
+from .fulltext import FileIndex, PassageIndex, format_reference
+
+log = logging.getLogger("red.aidm")
 
 
 SYSTEM_PROMPT = """
@@ -26,6 +49,41 @@ Your responses should feel natural and conversational, like a DM at the table. U
 - End by inviting the player to choose their next action.
 Do not use rigid numbered sections unless the situation genuinely benefits from it
 """
+# Parsed class/ directory listing, stored in the file cache next to the class files
+CLASS_LISTING = "class/_listing.json"
+CLASS_DISCOVERY_TIMEOUT = 10
+# Files the warm-up couldn't load are retried in the background, never by a
+# question: first after RETRY_FIRST_DELAY seconds, doubling up to RETRY_MAX_DELAY
+RETRY_FIRST_DELAY = 60
+RETRY_MAX_DELAY = 3600
+# Rolling session summary: once a channel holds more than SUMMARY_TRIGGER turn
+# messages, all but the newest SUMMARY_KEEP are folded into the summary in the
+# background. MAX_TURNS caps the context if summarization keeps failing.
+SUMMARY_TRIGGER = 12
+SUMMARY_KEEP = 6
+MAX_TURNS = 40
+SUMMARY_PREFIX = "Session summary: "
+# Rules passages retrieved for questions the name lookup can't answer. Each
+# must reach REFERENCE_MIN_SHARE of the question's idf mass (see fulltext);
+# a question naming no rules category needs a best passage of
+# REFERENCE_STRONG_SHARE, so story turns don't get unrelated rules text.
+REFERENCE_PASSAGES = 3
+REFERENCE_MIN_SHARE = 0.5
+REFERENCE_STRONG_SHARE = 0.75
+REFERENCE_PROMPT = (
+    "Rules text from 5etools that may answer the player's question. Base your answer on it when it "
+    "applies, keep numbers exactly as written, and answer briefly.\n"
+)
+# Longest wait for a rate-limited key before a request gives up
+MAX_KEY_WAIT = 10
+# Longest an index lookup or entry render may run in the search pool (seconds)
+SEARCH_TIMEOUT = 5
+# Message triggers: a typed "@dm" prefix, or a leading role mention to strip
+DM_TRIGGER = re.compile(r"\s*@dm", re.IGNORECASE)
+ROLE_MENTION = re.compile(r"\s*<@&\d+>")
+# camelCase key → words, for prettify_key
+KEY_WORDS = re.compile(r'[A-Z]?[a-z]+|[A-Z]+(?=[A-Z]|$)')
+
 class _DirectoryParser(HTMLParser):
     """Simple built‑in HTML parser to extract <a href="..."> links."""
     def __init__(self):
@@ -47,12 +105,55 @@ class AiDm(commands.Cog):
         self.config.register_global(api_keys=[])
         self.config.register_global(model="deepseek/deepseek-chat-v3.1:free")
         self.config.register_global(fivetools_url="http://localhost:5050/data")
+        self.config.register_global(warmup_concurrency=6)
+        self.config.register_global(reload_interval=0)
+        self.config.register_global(http_timeout=120, http_connect_timeout=10, http_limit_per_host=8)
+        self.config.register_global(stream_replies=True)
+        self.config.register_global(reply_cache_ttl=86400, reply_cache_size=500)
+        self.config.register_global(render_cache_kb=4096)
+        self.config.register_global(prompt_token_budget=3000)
+        self.config.register_global(reference_chars=1500)
+        self.config.register_global(model_slots_per_key=2, channel_queue_depth=3)
 
         self.config.register_channel(context=[])
-        self.key_index = 0  # For round-robin rotation
-
-        # Lazy cache for 5etools JSON files
+        self.config.register_guild(dm_role_id=None)
+        # Per-key health; requests go to the healthiest key that isn't cooling down
+        self.key_pool = KeyPool()
+        # Global model slots (sized to the key pool) and per-channel turn queues
+        self.admission = Admission()
+
+        # Channel contexts live in memory and are written back to Config in batches
+        self.conversations = ConversationStore(self.config)
+        self.prompt_stats = PromptStats()
+        # Per-stage latency spans, logged and aggregated into percentiles
+        self.tracer = Tracer()
+        # Background summarization, at most one task per channel
+        self.summary_tasks = {}
+        self.summary_stats = {"runs": 0, "failed": 0, "stale": 0, "turns_folded": 0, "seconds": 0.0}
+
+        # Loaded 5etools files as compact entry records (endpoint -> list of EntryRecord)
         self.fivetools_cache = {}
+        # Raw files + ETag/Last-Modified on disk, revalidated on next load
+        self.file_cache = FileCache(cog_data_path(self) / "5etools")
+        # Version of each loaded file (content hash, or bundle mtime/CRC), compared on reload
+        self.file_versions = {}
+        # Fuzzy name index, filled as each file is loaded; duplicates ordered by source_rank
+        self.name_index = NameIndex(rank=source_rank)
+        # Rendered entries, dropped per file when that file is reloaded
+        self.render_cache = RenderCache()
+        # BM25 over entry bodies, for grounding AI answers when no name matches
+        self.passage_index = PassageIndex()
+        self.reference_stats = Counter()
+        # Fuzzy search and entry formatting run here, off the event loop
+        self.search_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="aidm-search")
+        # Cancel events of in-flight lookups per (channel, user); a newer question cancels the older one
+        self.lookups = {}
+        # How category-routed lookups ended: routed hit, global fallback, or unrouted
+        self.route_stats = Counter()
+        # Trigger role per guild id, mirrored from Config so on_message never awaits it
+        self.dm_roles = {}
+        # on_message outcomes: seen, filtered, handled
+        self.message_stats = Counter()
 
         # Files to search (all content, not just SRD)
         self.fivetools_files = [
@@ -70,41 +171,179 @@ class AiDm(commands.Cog):
             "backgrounds.json",
             "races.json",
            ]
-        bot.loop.create_task(self._load_class_files())
+
+        # Replies to context-free rules questions, persisted between reloads
+        self.reply_cache = ReplyCache(cog_data_path(self) / "reply_cache.json")
+        self.reply_cache_lock = asyncio.Lock()
+
+        # Local 5etools directory or zip when fivetools_url is a file:// URL
+        self.bundle = None
+        # One pooled HTTP session for OpenRouter and 5etools, created on first use
+        self.session = None
+        self.http_stats = HttpStats()
+
+        # Startup warm-up of the 5etools files
+        self.warmup_task = None
+        self.warmup_status = {}
+        self.retry_task = None
+        self.start_warmup()
+        # Hot reload: only changed files are re-fetched and swapped into the indexes
+        self.reload_lock = asyncio.Lock()
+        self.reload_task = None
+        self.reload_status = {}
+
+    async def cog_load(self):
+        self.reply_cache.ttl = await self.config.reply_cache_ttl()
+        self.reply_cache.max_entries = await self.config.reply_cache_size()
+        self.render_cache.resize(await self.config.render_cache_kb() * 1024)
+        self.admission.max_queue = await self.config.channel_queue_depth()
+        await self.size_admission()
+        await asyncio.to_thread(self.reply_cache.load)
+        self.dm_roles = {
+            guild_id: data["dm_role_id"]
+            for guild_id, data in (await self.config.all_guilds()).items()
+            if data.get("dm_role_id")
+        }
+        self.conversations.start()
+        self.start_autoreload(await self.config.reload_interval())
+
+    async def cog_unload(self):
+        """Cancel background tasks, save unsaved contexts and close the HTTP session."""
+        if self.warmup_task:
+            self.warmup_task.cancel()
+        if self.retry_task:
+            self.retry_task.cancel()
+        if self.reload_task:
+            self.reload_task.cancel()
+        for task in self.summary_tasks.values():
+            task.cancel()
+        for cancel in self.lookups.values():
+            cancel.set()
+        self.search_pool.shutdown(wait=False, cancel_futures=True)
+        await self.conversations.stop()
+        if self.bundle:
+            self.bundle.close()
+        if self.session and not self.session.closed:
+            await self.session.close()
+
+    async def get_session(self) -> aiohttp.ClientSession:
+        """Return the cog's long-lived HTTP session, creating it if needed."""
+        if self.session is None or self.session.closed:
+            self.session = make_session(
+                self.http_stats,
+                total_timeout=await self.config.http_timeout(),
+                connect_timeout=await self.config.http_connect_timeout(),
+                limit_per_host=await self.config.http_limit_per_host(),
+            )
+        return self.session
+
+    def start_warmup(self):
+        """(Re)start the background 5etools warm-up."""
+        if self.warmup_task and not self.warmup_task.done():
+            self.warmup_task.cancel()
+        if self.retry_task and not self.retry_task.done():
+            self.retry_task.cancel()
+        self.warmup_task = self.bot.loop.create_task(self.warm_5etools())
+
+    def start_autoreload(self, minutes: int):
+        """(Re)start the periodic 5etools reload, or stop it when `minutes` is 0."""
+        if self.reload_task and not self.reload_task.done():
+            self.reload_task.cancel()
+        self.reload_task = self.bot.loop.create_task(self._autoreload(minutes * 60)) if minutes > 0 else None
+
+    async def _autoreload(self, seconds: int):
+        while True:
+            await asyncio.sleep(seconds)
+            try:
+                await self.reload_5etools()
+            except Exception:
+                log.exception("5etools auto-reload failed")
+
+    def warming_up(self) -> bool:
+        return bool(self.warmup_task and not self.warmup_task.done())
+
+    async def warm_5etools(self):
+        """Fetch the configured and class 5etools files concurrently over one session."""
+        await self._load_class_files()
+
+        files = [f for f in self.fivetools_files if f not in self.fivetools_cache]
+        concurrency = max(1, await self.config.warmup_concurrency())
+        status = {
+            "total": len(files),
+            "loaded": 0,
+            "failed": [],
+            "started": datetime.now(),
+            "finished": None,
+        }
+        self.warmup_status = status
+        log.info("5etools warm-up: fetching %s files (concurrency=%s)", len(files), concurrency)
+
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def load(file):
+            async with semaphore:
+                data = await self.fetch_5etools_file(file)
+            if data is None:
+                status["failed"].append(file)
+            else:
+                status["loaded"] += 1
+            done = status["loaded"] + len(status["failed"])
+            log.debug(
+                "5etools warm-up %s/%s: %s %s", done, status["total"], file, "ok" if data is not None else "FAILED"
+            )
+
+        await asyncio.gather(*(load(file) for file in files))
+
+        status["finished"] = datetime.now()
+        elapsed = (status["finished"] - status["started"]).total_seconds()
+        log.info(
+            "5etools warm-up finished in %.1fs: %s loaded, %s failed",
+            elapsed, status["loaded"], len(status["failed"]),
+        )
+        if status["failed"]:
+            self.retry_task = asyncio.create_task(self._retry_failed(status))
+
+    async def _retry_failed(self, status: dict):
+        """Keep retrying the warm-up's failed files, with backoff, until they load."""
+        delay = RETRY_FIRST_DELAY
+        while status["failed"]:
+            status["next_retry"] = datetime.now() + timedelta(seconds=delay)
+            await asyncio.sleep(delay)
+            for file in list(status["failed"]):
+                if await self.fetch_5etools_file(file) is not None:
+                    status["failed"].remove(file)
+                    status["loaded"] += 1
+            log.info("5etools retry: %s files still missing", len(status["failed"]))
+            delay = min(delay * 2, RETRY_MAX_DELAY)
+        status["next_retry"] = None
+
+    async def get_bundle(self):
+        """The local 5etools bundle when fivetools_url is a file:// URL, else None."""
+        path = local_path(await self.config.fivetools_url())
+        if path is None:
+            return None
+        if self.bundle is None or self.bundle.path != path:
+            if self.bundle:
+                self.bundle.close()
+            self.bundle = await asyncio.to_thread(LocalBundle, path)
+        return self.bundle
 
     async def _load_class_files(self):
         """Fetch all class/*.json files from the 5etools backend and append them."""
-        await asyncio.sleep(0)  # yield to event loop
-
         base_url = await self.config.fivetools_url()
         class_url = f"{base_url.rstrip('/')}/class/"
 
         class_files = []
 
         try:
-            with urllib.request.urlopen(class_url) as response:
-                html = response.read().decode("utf-8")
-
-            parser = _DirectoryParser()
-            parser.feed(html)
-
-            for raw in parser.links:
-                # Normalize the filename (fixes the startswith issue)
-                link = raw.strip().lstrip("./")
-
-                # Skip unwanted files
-                if "fluff" in link:
-                    continue
-                if link.startswith("index"):
-                    continue
-                if link.startswith("foundry"):
-                    continue
-
-                # Only accept JSON files that start with "class-"
-                if link.startswith("class-") and link.endswith(".json"):
-                    class_files.append(f"class/{link}")
+            bundle = await self.get_bundle()
+            if bundle:
+                names = await asyncio.to_thread(bundle.list_dir, "class")
+                class_files = self._pick_class_files(names)
+            else:
+                class_files = await self._discover_class_files(class_url)
         except Exception as e:
-            print(f"[AiDm] Failed to load class directory: {e}")
+            log.warning("Failed to load class directory: %s", e)
 
         # Fall back to a known set of class JSON files when the server doesn't provide an index.
         if not class_files:
@@ -130,38 +369,110 @@ class AiDm(commands.Cog):
             if file not in self.fivetools_files:
                 self.fivetools_files.append(file)
 
-        print("[AiDm] Loaded class files:", self.fivetools_files)
+        log.debug("Loaded class files: %s", self.fivetools_files)
+
+    async def _discover_class_files(self, class_url: str) -> list:
+        """
+        List class/*.json from the backend's directory index without blocking the loop.
+        The parsed list is kept in the file cache with the listing's validators, so an
+        unchanged listing (304) or an unreachable backend reuses it without re-parsing.
+        """
+        raw, meta = await asyncio.to_thread(self.file_cache.load, CLASS_LISTING, class_url)
+        headers = FileCache.conditional_headers(meta)
+        session = await self.get_session()
 
-    async def get_next_key(self):
-        """Return next API key from pool or fall back to OPENROUTER_API_KEY env var."""
+        try:
+            async with session.get(
+                class_url,
+                headers=headers,
+                timeout=aiohttp.ClientTimeout(total=CLASS_DISCOVERY_TIMEOUT),
+            ) as response:
+                if response.status == 304 and raw is not None:
+                    log.debug("5etools class listing unchanged, using cached list")
+                    return json.loads(raw)
+                response.raise_for_status()
+                html = await response.text()
+                etag = response.headers.get("ETag")
+                last_modified = response.headers.get("Last-Modified")
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            if raw is None:
+                raise
+            log.warning("5etools class listing unavailable (%r), using cached list", e)
+            return json.loads(raw)
+
+        class_files = self._parse_class_listing(html)
+        if class_files:
+            meta = {"url": class_url, "etag": etag, "last_modified": last_modified}
+            await asyncio.to_thread(self.file_cache.save, CLASS_LISTING, json.dumps(class_files).encode(), meta)
+        return class_files
+
+    def _parse_class_listing(self, html: str) -> list:
+        """Pick the class-*.json files out of an HTML directory listing."""
+        parser = _DirectoryParser()
+        parser.feed(html)
+        return self._pick_class_files(parser.links)
+
+    def _pick_class_files(self, names) -> list:
+        """class/ paths for the class-*.json names in a directory listing."""
+        class_files = []
+        for raw in names:
+            # Normalize the filename (fixes the startswith issue)
+            link = raw.strip().lstrip("./")
+
+            # Skip unwanted files
+            if "fluff" in link:
+                continue
+            if link.startswith("index"):
+                continue
+            if link.startswith("foundry"):
+                continue
+
+            # Only accept JSON files that start with "class-"
+            if link.startswith("class-") and link.endswith(".json"):
+                class_files.append(f"class/{link}")
+        return class_files
+
+    async def pool_keys(self) -> list:
+        """Configured key pool, or OPENROUTER_API_KEY from the environment as a pool of one."""
         keys = await self.config.api_keys()
         if keys:
-            key = keys[self.key_index % len(keys)]
-            self.key_index += 1
-            print(f"[aidm] Using API key {self.key_index}/{len(keys)} from config pool")
-            return key
+            return keys
         env_key = os.environ.get("OPENROUTER_API_KEY")
-        if env_key:
-            print("[aidm] Using OPENROUTER_API_KEY from environment")
-        else:
-            print("[aidm] No OpenRouter API key available")
-        return env_key
+        return [env_key] if env_key else []
 
-    def hide_mechanics(self, text: str) -> str:
-        # CR or DC followed by optional space and digits
-        text = re.sub(r'\b(CR|DC)\s?(\d+)\b', r'||\1\2||', text)
-
-        # Rolls like: "Roll 1d20 = 14" or "1d20: 14"
-        text = re.sub(r'(\d+d\d+)\s*[:=]\s*(\d+)', r'||\1 = \2||', text)
+    async def size_admission(self):
+        """Give the global model semaphore `model_slots_per_key` slots per pool key."""
+        per_key = await self.config.model_slots_per_key()
+        self.admission.resize(per_key * max(1, len(await self.pool_keys())))
 
-        # Standalone roll results like "Roll: 14" or "roll 17"
-        text = re.sub(r'\b[Rr]oll(?:ed)?[: ]+(\d+)\b', r'||Roll \1||', text)
+    async def get_next_key(self, tried=()):
+        """
+        Return the healthiest key, preferring ones this request hasn't tried.
+        Waits out a short cooldown when every key is rate limited; returns
+        None when no key is configured.
+        """
+        keys = await self.pool_keys()
+        if not keys:
+            log.warning("No OpenRouter API key available")
+            return None
+        key, wait = self.key_pool.pick(keys, exclude=tried)
+        if key is None:
+            key, wait = self.key_pool.pick(keys)
+        if wait > MAX_KEY_WAIT:
+            raise RuntimeError(f"All OpenRouter keys are rate-limited (next free in {wait:.0f}s).")
+        if wait > 0:
+            log.info("All keys cooling down, waiting %.1fs for %s", wait, mask_key(key))
+            await asyncio.sleep(wait)
+        log.debug("Using API key %s (%s/%s)", mask_key(key), keys.index(key) + 1, len(keys))
+        return key
 
-        return text
+    def hide_mechanics(self, text: str) -> str:
+        # DC/CR values and roll results become spoilers (see markup.hide_mechanics)
+        return markup.hide_mechanics(text)
 
     # Fuzzy keyword extraction using n-grams
     def extract_keyword_fuzzy(self, raw_text: str):
-        print(f"[aidm] extract_keyword_fuzzy input: '{raw_text}'")
+        log.debug("extract_keyword_fuzzy input: %r", raw_text)
         try:
             stop_words = {
                 'a', 'an', 'the', 'and', 'or', 'but', 'if', 'while', 'with', 'to', 'from', 'in', 'on', 'at',
@@ -185,116 +496,294 @@ class AiDm(commands.Cog):
                     most_common = Counter(ngrams).most_common(1)
                     if most_common:
                         keyword = most_common[0][0]
-                        print(f"✅ Fuzzy keyword extracted (n={n}): {keyword}")
+                        log.debug("Fuzzy keyword extracted (n=%s): %s", n, keyword)
                         return keyword
 
-            print("⚠️ No keyword extracted from input.")
+            log.debug("No keyword extracted from input.")
             return None
 
-        except Exception as e:
-            print(f"❌ Failed to extract keyword: {e}")
+        except Exception:
+            log.exception("Failed to extract keyword")
             return None
 
-    async def build_prompt(self, channel, new_question: str):
-        context = await self.config.channel(channel).context()
-        messages = [{"role": "system", "content": SYSTEM_PROMPT}]
-        messages.extend(context)
-        messages.append({"role": "user", "content": new_question})
-        return messages
+    async def build_prompt(self, channel, new_question: str, passages=()):
+        """
+        System prompt, retrieved rules passages (capped at reference_chars),
+        session summary and the newest turns that fit the token budget.
+        """
+        context = await self.conversations.get(channel)
+        budget = await self.config.prompt_token_budget()
+        system = [{"role": "system", "content": SYSTEM_PROMPT}]
+        if passages:
+            reference = format_reference(passages, await self.config.reference_chars())
+            if reference:
+                system.append({"role": "system", "content": REFERENCE_PROMPT + reference})
+                self.reference_stats["attached"] += 1
+                self.reference_stats["chars"] += len(reference)
+        with self.tracer.span("build_prompt"):
+            window = fit_context(
+                system,
+                context,
+                {"role": "user", "content": new_question},
+                budget,
+            )
+        self.prompt_stats.record(window.tokens, window.trimmed_tokens)
+        log.info(
+            "prompt_tokens=%s budget=%s turns=%s/%s trimmed_tokens=%s",
+            window.tokens, budget, window.kept, window.available, window.trimmed_tokens,
+        )
+        return window.messages
+
+    async def update_context(self, channel, user_input, bot_reply, rules: bool = False):
+        """Append a turn; rules Q&A turns are marked so they don't count as adventure context."""
+        context = await self.conversations.get(channel)
+        summaries = [m for m in context if is_summary(m)]
+        new = [{"role": "user", "content": user_input}, {"role": "assistant", "content": bot_reply}]
+        if rules:
+            for m in new:
+                m["rules"] = True
+        turns = [m for m in context if not is_summary(m)] + new
+        # The session summary always survives trimming
+        self.conversations.set(channel, summaries + turns[-MAX_TURNS:])
+        if len(turns) > SUMMARY_TRIGGER:
+            self.schedule_summary(channel)
+
+    @staticmethod
+    def latest_summary(context: list):
+        """Text of the channel's session summary, or None."""
+        for message in reversed(context):
+            if is_summary(message):
+                content = message["content"]
+                return content[len(SUMMARY_PREFIX):] if content.startswith(SUMMARY_PREFIX) else content
+        return None
 
-    async def update_context(self, channel, user_input, bot_reply):
-        context = await self.config.channel(channel).context()
-        context.append({"role": "user", "content": user_input})
-        context.append({"role": "assistant", "content": bot_reply})
-        context = context[-12:]
-        await self.config.channel(channel).context.set(context)
+    def schedule_summary(self, channel):
+        """Fold old turns into the summary in the background, unless a fold is already running."""
+        task = self.summary_tasks.get(channel.id)
+        if task and not task.done():
+            return
+        self.summary_tasks[channel.id] = asyncio.create_task(self.summarize_context(channel))
 
     async def summarize_context(self, channel):
-        context = await self.config.channel(channel).context()
-        if len(context) < 6:
+        """
+        Fold all but the newest SUMMARY_KEEP turns into the session summary.
+        Runs without the channel lock, so new turns can land meanwhile; the
+        result is only applied if the folded turns are still at the front.
+        Returns the new summary, or None if nothing was folded.
+        """
+        # Runs as its own task; keep its spans out of the turn that started it
+        detach_turn()
+        context = await self.conversations.get(channel)
+        turns = [m for m in context if not is_summary(m)]
+        folded = turns[:-SUMMARY_KEEP]
+        if not folded:
             return None
 
+        previous = self.latest_summary(context)
+        transcript = "\n".join(
+            f"{'Player' if m['role'] == 'user' else 'DM'}: {m['content']}" for m in folded
+        )
         messages = [
-            {"role": "system", "content": "Summarize this D&D conversation in under 1000 characters."},
-            {"role": "user", "content": "\n".join([msg["content"] for msg in context if msg["role"] == "user"])}
+            {
+                "role": "system",
+                "content": (
+                    "You keep the running summary of a D&D session. Merge the new exchanges into the "
+                    "existing summary: who the characters are, where they are, what happened, open "
+                    "threads and promises. Reply with the updated summary only, under 1000 characters."
+                ),
+            },
+            {
+                "role": "user",
+                "content": f"Existing summary:\n{previous or '(none yet)'}\n\nNew exchanges:\n{transcript}",
+            },
         ]
 
-        summary = await self.query_ai(messages)
+        start = time.perf_counter()
+        try:
+            with self.tracer.span("summarize_context", turns=len(folded)):
+                summary = await self.query_ai(messages)
+        except Exception as e:
+            self.summary_stats["failed"] += 1
+            log.warning("Session summary failed for channel %s: %s", channel.id, e)
+            return None
+        elapsed = time.perf_counter() - start
         cleaned = summary.replace("<｜begin▁of▁sentence｜>", "").strip()
 
-        await self.config.channel(channel).context.set([
-            {"role": "system", "content": "Session summary: " + cleaned}
-        ])
-
-        try:
-            await channel.send(f"📝 **Session recap:** {cleaned}")
-        except Exception:
-            pass
+        # The context may have been reset or trimmed while the model was busy
+        current = await self.conversations.get(channel)
+        current_turns = [m for m in current if not is_summary(m)]
+        if len(current_turns) < len(folded) or any(a is not b for a, b in zip(current_turns, folded)):
+            self.summary_stats["stale"] += 1
+            log.info("Session summary for channel %s discarded, context changed", channel.id)
+            return None
 
+        self.conversations.set(
+            channel,
+            [{"role": "system", "content": SUMMARY_PREFIX + cleaned}] + current_turns[len(folded):],
+        )
+        self.summary_stats["runs"] += 1
+        self.summary_stats["turns_folded"] += len(folded)
+        self.summary_stats["seconds"] += elapsed
+        log.info("Folded %s turns into the session summary for channel %s in %.1fs", len(folded), channel.id, elapsed)
         return cleaned
 
     async def query_ai(self, messages):
         """Single consolidated query function with rotation/backoff and better error surfacing."""
+        with self.tracer.span("query_ai", messages=len(messages)):
+            return await self._query_ai(messages)
+
+    async def _query_ai(self, messages):
+        async with self._completion(messages) as resp:
+            text = await resp.text()
+            try:
+                data = json.loads(text)
+            except ValueError:
+                log.warning("OpenRouter returned non-json response (status=%s)", resp.status)
+                raise RuntimeError(f"OpenRouter HTTP {resp.status}, non-json response: {text}")
+
+            if isinstance(data, dict) and "choices" in data and data["choices"]:
+                choice = data["choices"][0]
+                if isinstance(choice.get("message"), dict) and "content" in choice["message"]:
+                    content = choice["message"]["content"]
+                    log.debug("OpenRouter returned content length %s", len(content))
+                    return content
+                if "text" in choice:
+                    text_resp = choice["text"]
+                    log.debug("OpenRouter returned text length %s", len(text_resp))
+                    return text_resp
+                log.error("OpenRouter returned unexpected structure: %s", data)
+                raise RuntimeError(f"OpenRouter returned unexpected structure: {data}")
+
+            error_msg = data.get("error") if isinstance(data, dict) else None
+            log.error("OpenRouter error response: %s", error_msg or text)
+            raise RuntimeError(f"OpenRouter error: {error_msg or text}")
+
+    async def query_ai_stream(self, messages):
+        """Stream a completion as text deltas. Keys rotate on 429 until the first token arrives."""
+        async with self._completion(messages, stream=True) as resp:
+            async for delta in iter_sse_deltas(resp):
+                yield delta
+
+    @contextlib.asynccontextmanager
+    async def _completion(self, messages, stream: bool = False):
+        """
+        POST a chat completion for query_ai and query_ai_stream, rotating keys
+        on 429, and yield the first successful response. Any other HTTP error
+        raises RuntimeError with OpenRouter's message.
+        """
         model = await self.config.model() or "deepseek/deepseek-chat-v3.1:free"
         payload = {"model": model, "messages": messages, "temperature": 0.7}
+        if stream:
+            payload["stream"] = True
         headers_base = {"Content-Type": "application/json"}
 
-        print(f"[aidm] query_ai called (model={model}, messages={len(messages)})")
+        log.debug("OpenRouter request (model=%s, messages=%s, stream=%s)", model, len(messages), stream)
 
-        keys = await self.config.api_keys()
-        attempts = max(1, len(keys) or 1)
+        # Every key once, plus one retry for a pool of one after its cooldown
+        attempts = len(await self.pool_keys()) + 1
+        tried = set()
 
+        session = await self.get_session()
         for attempt in range(attempts):
-            api_key = await self.get_next_key()
+            api_key = await self.get_next_key(tried)
             if not api_key:
                 raise RuntimeError("No OpenRouter API key available (set with addkey/setapikey or OPENROUTER_API_KEY).")
+            tried.add(api_key)
 
-            print(f"[aidm] query_ai attempt {attempt + 1}/{attempts}")
+            log.debug("OpenRouter attempt %s/%s", attempt + 1, attempts)
             headers = {**headers_base, "Authorization": f"Bearer {api_key}"}
 
-            async with aiohttp.ClientSession() as session:
-                async with session.post("https://openrouter.ai/api/v1/chat/completions", headers=headers, json=payload) as resp:
-                    print(f"[aidm] OpenRouter HTTP status: {resp.status}")
+            async with self._keyed_post(session, api_key, headers, payload) as resp:
+                log.debug("OpenRouter HTTP status: %s", resp.status)
+
+                if resp.status == 429:
+                    log.warning("OpenRouter rate limited (429), key %s cooling down", mask_key(api_key))
+                    continue
+
+                if resp.status >= 400:
                     text = await resp.text()
-                    try:
-                        data = await resp.json()
-                    except Exception:
-                        print(f"[aidm] OpenRouter returned non-json response (status={resp.status})")
-                        raise RuntimeError(f"OpenRouter HTTP {resp.status}, non-json response: {text}")
-
-                    if resp.status == 429:
-                        print(f"[aidm] OpenRouter rate limited (429). Backing off...")
-                        await asyncio.sleep(min(10, 2 ** attempt))
-                        continue
-
-                    if resp.status >= 400:
-                        err_msg = None
-                        if isinstance(data, dict):
-                            err_msg = data.get("error") or data.get("message") or data.get("detail")
-                            if isinstance(err_msg, dict):
-                                err_msg = err_msg.get("message") or str(err_msg)
-                        print(f"[aidm] OpenRouter returned error {resp.status}: {err_msg or text}")
-                        raise RuntimeError(f"OpenRouter returned HTTP {resp.status}: {err_msg or text}")
-
-                    if isinstance(data, dict) and "choices" in data and data["choices"]:
-                        choice = data["choices"][0]
-                        if isinstance(choice.get("message"), dict) and "content" in choice["message"]:
-                            content = choice["message"]["content"]
-                            print(f"[aidm] OpenRouter returned content length {len(content)}")
-                            return content
-                        if "text" in choice:
-                            text_resp = choice["text"]
-                            print(f"[aidm] OpenRouter returned text length {len(text_resp)}")
-                            return text_resp
-                        print(f"[aidm] OpenRouter returned unexpected structure: {data}")
-                        raise RuntimeError(f"OpenRouter returned unexpected structure: {data}")
-
-                    error_msg = data.get("error") if isinstance(data, dict) else None
-                    print(f"[aidm] OpenRouter error response: {error_msg or text}")
-                    raise RuntimeError(f"OpenRouter error: {error_msg or text}")
+                    err_msg = self._error_message(text)
+                    log.warning("OpenRouter returned error %s: %s", resp.status, err_msg or text)
+                    raise RuntimeError(f"OpenRouter returned HTTP {resp.status}: {err_msg or text}")
+
+                yield resp
+                return
 
         raise RuntimeError("All OpenRouter keys exhausted or rate-limited.")
 
+    @staticmethod
+    def _error_message(text: str):
+        """The message in an OpenRouter error body, or None if it has none."""
+        try:
+            data = json.loads(text)
+        except ValueError:
+            return None
+        if not isinstance(data, dict):
+            return None
+        err_msg = data.get("error") or data.get("message") or data.get("detail")
+        if isinstance(err_msg, dict):
+            err_msg = err_msg.get("message") or str(err_msg)
+        return err_msg
+
+    @contextlib.asynccontextmanager
+    async def _keyed_post(self, session, api_key, headers, payload):
+        """
+        POST a chat completion inside a global model slot, reporting status
+        and latency to the key pool.
+        """
+        waited = time.perf_counter()
+        async with self.admission.model_slot():
+            self.tracer.record("model_slot_wait", (time.perf_counter() - waited) * 1000)
+            started = self.key_pool.started(api_key)
+            responded = False
+            try:
+                async with session.post("https://openrouter.ai/api/v1/chat/completions", headers=headers, json=payload) as resp:
+                    self.key_pool.responded(
+                        api_key, started, resp.status, retry_after=parse_retry_after(resp.headers.get("Retry-After"))
+                    )
+                    responded = True
+                    yield resp
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if not responded:
+                    self.key_pool.responded(api_key, started, None, error=str(e) or type(e).__name__)
+                raise
+            finally:
+                self.key_pool.released(api_key)
+
+    async def stream_reply(self, channel, messages) -> str:
+        """Post a placeholder and edit it as the reply streams in. Returns the full reply."""
+        streamer = MessageStreamer(
+            channel,
+            render=lambda text: self.hide_mechanics(text.replace("<｜begin▁of▁sentence｜>", "").lstrip()),
+            prefix="DM Says: ",
+        )
+        await streamer.start()
+        started = datetime.now()
+        first_token = None
+
+        try:
+            with self.tracer.span("query_ai_stream", messages=len(messages)):
+                async for delta in self.query_ai_stream(messages):
+                    if first_token is None:
+                        first_token = (datetime.now() - started).total_seconds()
+                        self.tracer.record("first_token", first_token * 1000)
+                    await streamer.feed(delta)
+        except Exception:
+            if not streamer.text.strip():
+                await streamer.messages[0].delete()
+            raise
+
+        if not streamer.text.strip():
+            await streamer.messages[0].delete()
+            raise RuntimeError("OpenRouter returned an empty reply.")
+
+        reply = await streamer.finish()
+        log.info(
+            "streamed reply (length=%s, messages=%s, total=%.2fs)",
+            len(reply), len(streamer.messages), (datetime.now() - started).total_seconds(),
+        )
+        return reply.replace("<｜begin▁of▁sentence｜>", "").strip()
+
     async def summarize_text(self, long_text: str):
         messages = [
             {"role": "system", "content": "You are a helpful Dungeon Master for D&D 5e."},
@@ -303,10 +792,32 @@ class AiDm(commands.Cog):
         summary = await self.query_ai(messages)
         return summary.replace("<｜begin▁of▁sentence｜>", "").strip()
 
+    async def cache_reply(self, model: str, question: str, reply: str):
+        """Store a context-free reply and write the cache file off the event loop."""
+        self.reply_cache.put(model, question, reply)
+        await self.save_reply_cache()
+
+    async def save_reply_cache(self):
+        """
+        Write the reply cache file in a worker thread, one write at a time,
+        each from a snapshot taken when its turn comes. A failed write is
+        only logged: the reply it follows has already been sent.
+        """
+        async with self.reply_cache_lock:
+            try:
+                await asyncio.to_thread(self.reply_cache.save, self.reply_cache.snapshot())
+            except OSError as e:
+                log.warning("Couldn't save the reply cache: %s", e)
+
     async def send_long_message(self, channel, text):
         chunks = [text[i:i+2000] for i in range(0, len(text), 2000)]
-        for chunk in chunks:
-            await channel.send(chunk)
+        with self.tracer.span("discord_send", chunks=len(chunks)):
+            for chunk in chunks:
+                await channel.send(chunk)
+
+    async def send_lines(self, ctx, lines: list):
+        """Send status lines as one code block."""
+        await ctx.send("```\n" + "\n".join(lines) + "\n```")
 
     def is_question_like(self, message: str) -> bool:
         if message.strip().startswith("!"):
@@ -323,74 +834,275 @@ class AiDm(commands.Cog):
     # ---------- 5ETOOLS INTEGRATION ----------
 
     async def fetch_5etools_file(self, endpoint: str):
-        """Lazy-load a 5etools JSON file and cache it."""
+        """Lazy-load a 5etools JSON file and cache its entry records."""
         if endpoint in self.fivetools_cache:
-            print(f"[aidm] 5etools cache hit for {endpoint}")
+            log.debug("5etools cache hit for %s", endpoint)
             return self.fivetools_cache[endpoint]
 
         base = await self.config.fivetools_url()
         url = f"{base.rstrip('/')}/{endpoint}"
-        print(f"[aidm] Fetching 5etools file: {url}")
+        log.debug("Fetching 5etools file: %s", url)
 
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url) as resp:
-                    if resp.status != 200:
-                        print(f"⚠️ 5etools fetch failed {resp.status} for {url}")
+            with self.tracer.span("fetch_5etools", endpoint=endpoint):
+                bundle = await self.get_bundle()
+                if bundle:
+                    # Read (memory-mapped), decode and project in a worker thread
+                    version = await asyncio.to_thread(bundle.version, endpoint)
+                    records = await asyncio.to_thread(bundle.load_records, endpoint)
+                    if records is None:
+                        log.warning("5etools file not in local bundle: %s", endpoint)
                         return None
-                    data = await resp.json()
-                    self.fivetools_cache[endpoint] = data
-                    return data
+                    self.file_versions[endpoint] = version
+                    return await self._store_records(endpoint, records)
+                return await self._get_5etools_json(await self.get_session(), endpoint, url)
         except Exception as e:
-            print(f"❌ Error fetching 5etools file {endpoint}: {e}")
+            log.error("Error fetching 5etools file %s: %s", endpoint, e)
             return None
 
-    def _extract_entries_from_5etools(self, data: dict):
-        """Extract all list-like entry collections from a 5etools JSON file."""
-        if not isinstance(data, dict):
-            return []
+    async def _get_5etools_json(self, session, endpoint: str, url: str):
+        """GET a 5etools file, revalidating the on-disk copy when there is one."""
+        raw, _ = await self._revalidate(session, endpoint, url)
+        if raw is None:
+            return None
+
+        # Decode and project off the event loop; only the records are kept
+        records = await asyncio.to_thread(load_records, raw)
+        self.file_versions[endpoint] = await asyncio.to_thread(content_hash, raw)
+        return await self._store_records(endpoint, records)
+
+    async def _revalidate(self, session, endpoint: str, url: str):
+        """
+        Conditional GET against the on-disk copy. Returns (raw, fresh), where
+        fresh is False when the disk copy is used (304 or backend unreachable)
+        and raw is None when there is neither.
+        """
+        raw, meta = await asyncio.to_thread(self.file_cache.load, endpoint, url)
+        headers = FileCache.conditional_headers(meta)
+
+        try:
+            async with session.get(url, headers=headers) as resp:
+                if resp.status == 304 and raw is not None:
+                    log.debug("5etools file unchanged, loading from disk: %s", endpoint)
+                    return raw, False
+                elif resp.status != 200:
+                    log.warning("5etools fetch failed %s for %s", resp.status, url)
+                    return None, False
+                else:
+                    raw = await resp.read()
+                    meta = {
+                        "url": url,
+                        "etag": resp.headers.get("ETag"),
+                        "last_modified": resp.headers.get("Last-Modified"),
+                        "fetched": datetime.now().isoformat(),
+                    }
+                    await asyncio.to_thread(self.file_cache.save, endpoint, raw, meta)
+                    return raw, True
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            if raw is None:
+                raise
+            log.warning("5etools backend unreachable (%s), using disk copy of %s", e, endpoint)
+            return raw, False
+
+    async def _store_records(self, endpoint: str, records: list) -> list:
+        self.fivetools_cache[endpoint] = records
+        # Indexing waits on the index lock, which worker searches hold, so it runs in a
+        # thread too; stubs in this file, or waiting on it, become full entries as well
+        resolved = await asyncio.to_thread(self.name_index.replace_files, {endpoint: records})
+        self.render_cache.invalidate_file(endpoint)
+        changed = {endpoint}
+        for source in {self.name_index.source_of(record) for record in resolved}:
+            self.render_cache.invalidate_file(source)
+            changed.add(source)
+        if resolved:
+            log.debug("resolved %s _copy entries after loading %s", len(resolved), endpoint)
+        for source in changed:
+            if source in self.fivetools_cache:
+                built = await asyncio.to_thread(FileIndex, self.fivetools_cache[source])
+                self.passage_index.add_file(source, built)
+        return records
+
+    async def reload_5etools(self) -> dict:
+        """
+        Check every loaded 5etools file against its source and reindex only the
+        ones that changed (HTTP: conditional GET, then content hash; local
+        bundle: mtime/size or zip CRC). Changed files, plus unchanged files
+        holding copies of their entries, are swapped into the name index in
+        one step, then into the passage index. Returns the run's status.
+        """
+        if self.warming_up():
+            return {"skipped": "warm-up in progress"}
+        async with self.reload_lock:
+            started = time.perf_counter()
+            endpoints = list(self.fivetools_cache)
+            semaphore = asyncio.Semaphore(max(1, await self.config.warmup_concurrency()))
+
+            async def check(endpoint):
+                async with semaphore:
+                    try:
+                        return await self._check_5etools_file(endpoint)
+                    except Exception as e:
+                        log.warning("5etools reload check failed for %s: %s", endpoint, e)
+                        return None
 
-        entries = []
-        for key, value in data.items():
-            if isinstance(value, list) and value and isinstance(value[0], dict):
-                entries.extend(value)
-        return entries
+            checked = await asyncio.gather(*(check(endpoint) for endpoint in endpoints))
+            changed = {e: found for e, found in zip(endpoints, checked) if found is not None}
+            dependents = set()
+            if changed:
+                dependents = await asyncio.to_thread(self.name_index.dependents, set(changed))
+                await self._swap_5etools_files(changed, dependents)
+
+            self.reload_status = {
+                "finished": datetime.now(),
+                "checked": len(endpoints),
+                "changed": sorted(changed),
+                "dependents": sorted(dependents),
+                "seconds": time.perf_counter() - started,
+            }
+            log.info(
+                "5etools reload: %s checked, %s changed, %s re-resolved in %.2fs",
+                len(endpoints), len(changed), len(dependents), self.reload_status["seconds"],
+            )
+            return self.reload_status
+
+    async def _check_5etools_file(self, endpoint: str):
+        """(version, records) if the file changed since it was loaded, else None."""
+        bundle = await self.get_bundle()
+        if bundle:
+            version = await asyncio.to_thread(bundle.version, endpoint)
+            if version is None or version == self.file_versions.get(endpoint):
+                return None
+            records = await asyncio.to_thread(bundle.load_records, endpoint)
+            return (version, records) if records is not None else None
+
+        base = await self.config.fivetools_url()
+        raw, fresh = await self._revalidate(await self.get_session(), endpoint, f"{base.rstrip('/')}/{endpoint}")
+        if raw is None or not fresh:
+            return None
+        version = await asyncio.to_thread(content_hash, raw)
+        if version == self.file_versions.get(endpoint):
+            return None
+        return version, await asyncio.to_thread(load_records, raw)
 
-    def _similarity(self, a: str, b: str) -> float:
-        return difflib.SequenceMatcher(None, a.lower(), b.lower()).ratio()
+    async def _local_records(self, endpoint: str):
+        """Records re-read from the bundle or the on-disk copy, without a fetch."""
+        bundle = await self.get_bundle()
+        if bundle:
+            return await asyncio.to_thread(bundle.load_records, endpoint)
+        base = await self.config.fivetools_url()
+        raw, _ = await asyncio.to_thread(self.file_cache.load, endpoint, f"{base.rstrip('/')}/{endpoint}")
+        return await asyncio.to_thread(load_records, raw) if raw is not None else None
+
+    async def _swap_5etools_files(self, changed: dict, dependents: set):
+        """Replace changed files (and re-resolve their dependents) in every index and cache."""
+        files = {endpoint: records for endpoint, (_, records) in changed.items()}
+        # Copies of changed entries are rebuilt from their stubs, so they pick up the new parent
+        for endpoint in dependents:
+            records = await self._local_records(endpoint)
+            if records is not None:
+                files[endpoint] = records
+
+        resolved = await asyncio.to_thread(self.name_index.replace_files, files)
+        touched = set(files) | {self.name_index.source_of(record) for record in resolved}
+        touched.discard(None)
+        self.fivetools_cache.update(files)
+        for endpoint, (version, _) in changed.items():
+            self.file_versions[endpoint] = version
+
+        built = {}
+        for endpoint in touched:
+            if endpoint in self.fivetools_cache:
+                built[endpoint] = await asyncio.to_thread(FileIndex, self.fivetools_cache[endpoint])
+        self.passage_index.replace_files(built)
+        for endpoint in touched:
+            self.render_cache.invalidate_file(endpoint)
+
+    async def off_loop(self, call, cancel=None):
+        """
+        Run CPU-bound index or formatting work in the search pool. Raises
+        SearchCancelled if `cancel` is set first, and asyncio.TimeoutError
+        after SEARCH_TIMEOUT, in which case `cancel` is set so the worker stops.
+        """
+        if cancel is not None and cancel.is_set():
+            raise SearchCancelled()
+        future = asyncio.get_running_loop().run_in_executor(self.search_pool, call)
+        try:
+            return await asyncio.wait_for(future, SEARCH_TIMEOUT)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            if cancel is not None:
+                cancel.set()
+            raise
 
-    async def search_5etools(self, keyword: str):
+    async def lookup_5etools(self, raw_text: str, categories=None, cancel=None):
         """
-        Search across all configured 5etools files.
+        Find the 5etools entry a question is about. Entity names the question
+        asks about are matched exactly (longest first, the question's
+        categories before everything else); fuzzy search on an extracted
+        keyword only runs when there is none. A name that is only mentioned
+        ("can I hide behind my shield?") leaves the question to the DM. Setting `cancel`
+        (a threading.Event) abandons the lookup with SearchCancelled.
+        Only files already loaded are searched; nothing is fetched here.
+        """
+        if self.warming_up():
+            log.debug("5etools warm-up in progress, searching %s loaded entries", len(self.name_index))
+
+        passes = [intent.types_for(categories), None] if categories else [None]
+        for types in passes:
+            with self.tracer.span("entity_scan"):
+                entry = await self.off_loop(
+                    functools.partial(self.name_index.find_in, raw_text, types, cancel=cancel), cancel
+                )
+            if entry:
+                self.route_stats["exact"] += 1
+                log.info("5etools exact match %r in %r", entry.name, raw_text)
+                return entry
+
+        with self.tracer.span("extract_keyword"):
+            keyword = self.extract_keyword_fuzzy(raw_text)
+        if not keyword:
+            return None
+        log.debug("keyword extracted for 5etools lookup: %r", keyword)
+        return await self.search_5etools(keyword, categories, cancel)
+
+    async def search_5etools(self, keyword: str, categories=None, cancel=None):
+        """
+        Search across all loaded 5etools files.
         Uses fuzzy matching with a medium cutoff (~0.65).
+        With `categories` (see intent.classify), those records are searched
+        first and everything else only on a miss.
         Returns best matching entry or None.
         """
-        print(f"[aidm] Searching 5etools for keyword: '{keyword}'")
-        best_entry = None
-        best_score = 0.0
+        log.debug("Searching 5etools for keyword: %r (categories=%s)", keyword, categories or 'all')
         cutoff = 0.65
 
-        for file in self.fivetools_files:
-            print(f"[aidm] Searching file: {file}")
-            data = await self.fetch_5etools_file(file)
-            if not data:
-                continue
+        if categories:
+            with self.tracer.span("search_5etools", keyword=keyword, routed=True):
+                best_entry, best_score = await self.off_loop(
+                    functools.partial(self.name_index.search, keyword, intent.types_for(categories), cancel=cancel),
+                    cancel,
+                )
+            if best_entry and best_score >= cutoff:
+                self.route_stats["routed"] += 1
+                log.info(
+                    "5etools match %r in %s for %r (score=%.2f)",
+                    best_entry.name, ", ".join(categories), keyword, best_score,
+                )
+                return best_entry
+            self.route_stats["fallback"] += 1
+            log.debug("no match in %s, searching everything", ', '.join(categories))
+        else:
+            self.route_stats["unrouted"] += 1
 
-            entries = self._extract_entries_from_5etools(data)
-            for entry in entries:
-                name = entry.get("name")
-                if not name:
-                    continue
-                score = self._similarity(keyword, name)
-                if score > best_score:
-                    best_score = score
-                    best_entry = entry
+        with self.tracer.span("search_5etools", keyword=keyword, routed=False):
+            best_entry, best_score = await self.off_loop(
+                functools.partial(self.name_index.search, keyword, cancel=cancel), cancel
+            )
 
         if best_entry and best_score >= cutoff:
-            print(f"✅ 5etools match '{best_entry.get('name')}' for '{keyword}' (score={best_score:.2f})")
+            log.info("5etools match %r for %r (score=%.2f)", best_entry.name, keyword, best_score)
             return best_entry
 
-        print(f"⚠️ No 5etools match for '{keyword}' (best={best_score:.2f})")
+        log.info("No 5etools match for %r (best=%.2f)", keyword, best_score)
         return None
 
     def format_class_table_groups(self, groups):
@@ -513,57 +1225,23 @@ class AiDm(commands.Cog):
 
     def prettify_key(self, key: str) -> str:
         """Convert camelCase or mixedCase into 'Title Case'."""
-        words = re.findall(r'[A-Z]?[a-z]+|[A-Z]+(?=[A-Z]|$)', key)
+        words = KEY_WORDS.findall(key)
         return " ".join(w.capitalize() for w in words)
 
     def clean_5etools_markup(self, text: str) -> str:
         """Strip 5etools {@...} markup and keep readable content."""
         if not isinstance(text, str):
             return text
-
-        # Generic {@tag content|...} → content
-        text = re.sub(
-            r"\{@[a-zA-Z]+ ([^|}]+)(?:\|[^}]+)?\}",
-            r"\1",
-            text,
-        )
-
-        # Remove leftover |source|junk
-        text = re.sub(r"\|[a-zA-Z0-9]+", "", text)
-
-        # Remove any remaining {@...}
-        text = re.sub(r"\{@[^}]+\}", "", text)
-
-        return text.strip()
+        return markup.render_markup(text)
 
     def format_value(self, value):
         """Collapse any JSON value into a clean inline string with no braces."""
 
         # --- STRINGS ---
         if isinstance(value, str):
-            cleaned = self.clean_5etools_markup(value).strip()
-
-            # Convert class feature pipes: "Feature|Monk||3" → "Feature (Level 3)"
-            cleaned = re.sub(r"\|[A-Za-z]+?\|\|(\d+)", r" (Level \1)", cleaned)
-
-            # Convert prepared spell formulas like "<$level$> + <$int_mod$>"
-            formula_map = {
-                "level": "level",
-                "int_mod": "INT modifier",
-                "wis_mod": "WIS modifier",
-                "cha_mod": "CHA modifier",
-                "str_mod": "STR modifier",
-                "dex_mod": "DEX modifier",
-                "con_mod": "CON modifier",
-            }
-
-            def replace_formula(match):
-                key = match.group(1)
-                return formula_map.get(key, key)
-
-            cleaned = re.sub(r"<\$(.*?)\$>", replace_formula, cleaned)
-
-            return cleaned
+            # Markup, class feature pipes ("Feature|Monk||3" → "Feature (Level 3)")
+            # and spell formulas ("<$int_mod$>" → "INT modifier") in one pass
+            return markup.render_markup(value, formulas=True, features=True)
 
         # --- SIMPLE VALUES ---
         if isinstance(value, (int, float, bool)) or value is None:
@@ -670,6 +1348,19 @@ class AiDm(commands.Cog):
 
         return "\n".join(out)
 
+    async def render_5etools_entry(self, record) -> str:
+        """
+        format_5etools_entry for an entry record, memoized per source file and
+        record. Cache misses are formatted in the search pool.
+        """
+        source = self.name_index.source_of(record)
+        text = self.render_cache.get(source, record) if source is not None else None
+        if text is None:
+            text = await self.off_loop(lambda: self.format_5etools_entry(record.entry))
+            if source is not None:
+                self.render_cache.put(source, record, text)
+        return text
+
     def format_5etools_entry(self, entry: dict) -> str:
         out = [f"📘 5etools entry for **{entry.get('name', 'Unknown')}**\n"]
 
@@ -730,54 +1421,125 @@ class AiDm(commands.Cog):
     # ---------- MAIN HANDLER ----------
 
     async def handle_dnd_query(self, message: discord.Message):
+        with self.tracer.turn(channel=message.channel.id, user=message.author.id):
+            await self._handle_dnd_query(message)
+
+    async def _handle_dnd_query(self, message: discord.Message):
         user_id = message.author.id
-        raw_text = message.content.replace("@dm", "").strip()
-        print(f"[aidm] handle_dnd_query from user {user_id} in channel {getattr(message.channel, 'name', message.channel.id)}: '{raw_text}'")
+        trigger = DM_TRIGGER.match(message.content)
+        raw_text = message.content[trigger.end():].strip() if trigger else message.content.strip()
+        log.info(
+            "handle_dnd_query from user %s in channel %s: %r",
+            user_id, getattr(message.channel, "name", message.channel.id), raw_text,
+        )
 
         if not raw_text:
             return await message.channel.send("What would you like to ask the DM?")
 
+        # Rules passages for the prompt; only question-like turns look any up
+        passages = []
+        categories = intent.classify(raw_text)
+
         # Try 5etools lookup if question-like
-        keyword = None
         if self.is_question_like(raw_text):
-            keyword = self.extract_keyword_fuzzy(raw_text)
-            if keyword:
-                print(f"[aidm] keyword extracted for 5etools lookup: '{keyword}'")
-                entry = await self.search_5etools(keyword)
+            # A user's newer question supersedes their lookup still in flight here
+            key = (message.channel.id, user_id)
+            if key in self.lookups:
+                self.lookups[key].set()
+            cancel = self.lookups[key] = threading.Event()
+            formatted = None
+            try:
+                entry = await self.lookup_5etools(raw_text, categories, cancel)
                 if entry:
-                    print(f"[aidm] found 5etools entry: {entry.get('name')}")
-                    formatted = self.format_5etools_entry(entry)
-                    await self.send_long_message(
-                        message.channel,
-                        f"{formatted}"
-                    )
-                    return
+                    log.debug("found 5etools entry: %s", entry.name)
+                    with self.tracer.span("render_entry", entry=entry.name):
+                        formatted = await self.render_5etools_entry(entry)
                 else:
-                    print(f"[aidm] no 5etools entry matched '{keyword}'")
+                    log.info("no 5etools entry matched %r", raw_text)
+                    with self.tracer.span("retrieve_passages"):
+                        passages = await self.off_loop(
+                            functools.partial(
+                                self.passage_index.search, raw_text, REFERENCE_PASSAGES,
+                                cancel=cancel, min_share=REFERENCE_MIN_SHARE,
+                            ),
+                            cancel,
+                        )
+                    if passages and not categories and passages[0].share < REFERENCE_STRONG_SHARE:
+                        passages = []
+                    self.reference_stats["searched"] += 1
+                    self.reference_stats["found"] += bool(passages)
+                    log.debug("retrieved passages for %r: %s", raw_text, [p.heading for p in passages])
+            except SearchCancelled:
+                log.info("5etools lookup for %r superseded by a newer question", raw_text)
+                return
+            except asyncio.TimeoutError:
+                log.warning("5etools lookup for %r timed out after %ss", raw_text, SEARCH_TIMEOUT)
+            finally:
+                if self.lookups.get(key) is cancel:
+                    del self.lookups[key]
+            if formatted is not None:
+                await self.send_long_message(
+                    message.channel,
+                    f"{formatted}"
+                )
+                return
 
-        # Context prep
-        context = await self.config.channel(message.channel).context()
-        if len(context) > 12:
-            await self.summarize_context(message.channel)
+        # One turn at a time per channel, so replies never interleave in the context
+        try:
+            queued = time.perf_counter()
+            async with self.admission.channel(message.channel, self.conversations.lock(message.channel)):
+                self.tracer.record("queue_wait", (time.perf_counter() - queued) * 1000)
+                await self.ask_dm(message, raw_text, passages)
+        except Busy as e:
+            log.warning("channel %s busy (%s turns queued), turning message away", message.channel.id, e)
+            await message.channel.send("⏳ The DM is still busy with this table. Give them a moment and ask again.")
+
+    async def ask_dm(self, message: discord.Message, raw_text: str, passages=()):
+        """Answer with the AI DM, using and updating the channel's context and any rules passages."""
+        # Long contexts are summarized in the background by update_context
+        context = await self.conversations.get(message.channel)
 
         # AI fallback
         query_text = raw_text.lstrip("!? ")
-        messages = await self.build_prompt(message.channel, query_text)
+
+        # A rules question outside an adventure only depends on the question and model
+        rules = self.is_question_like(raw_text) and bool(passages or intent.classify(query_text))
+        cacheable = rules and not has_story(context)
+        model = await self.config.model() or "deepseek/deepseek-chat-v3.1:free"
+        if cacheable:
+            cached = self.reply_cache.get(model, query_text)
+            if cached:
+                log.info("reply cache hit for %r", query_text)
+                await self.send_long_message(message.channel, f"DM Says: {self.hide_mechanics(cached)}")
+                await self.update_context(message.channel, query_text, cached, rules)
+                return
+
+        messages = await self.build_prompt(message.channel, query_text, passages)
         try:
-            print(f"[aidm] Querying AI for message: '{query_text}'")
+            log.debug("Querying AI for message: %r", query_text)
+            if await self.config.stream_replies():
+                # Long replies roll over into extra messages instead of being summarized
+                reply = await self.stream_reply(message.channel, messages)
+                await self.update_context(message.channel, query_text, reply, rules)
+                if cacheable:
+                    await self.cache_reply(model, query_text, reply)
+                return
+
             reply = await self.query_ai(messages)
             reply = reply.replace("<｜begin▁of▁sentence｜>", "").strip()
-            print(f"[aidm] AI replied (length={len(reply)})")
+            log.debug("AI replied (length=%s)", len(reply))
 
             if len(reply) > 2000:
-                print("[aidm] AI reply >2000 chars, summarizing")
+                log.info("AI reply >2000 chars, summarizing")
                 reply = await self.summarize_text(reply)
 
             await self.send_long_message(message.channel, f"DM Says: {self.hide_mechanics(reply)}")
-            await self.update_context(message.channel, query_text, reply)
+            await self.update_context(message.channel, query_text, reply, rules)
+            if cacheable:
+                await self.cache_reply(model, query_text, reply)
 
         except Exception as e:
-            print(f"[aidm] AI query failed: {e}")
+            log.exception("AI query failed")
             await message.channel.send(f"Something went wrong: {e}")
 
     # ---------- LISTENERS ----------
@@ -806,72 +1568,86 @@ class AiDm(commands.Cog):
 
     @commands.Cog.listener()
     async def on_message(self, message: discord.Message):
+        # Runs for every message the bot sees, so nothing before the trigger check awaits
+        stats = self.message_stats
+        stats["seen"] += 1
         if message.author.bot or not message.guild:
+            stats["filtered"] += 1
             return
 
-        content = message.content.strip()
-
         # Literal typed trigger
-        if content.lower().startswith("@dm"):
+        if DM_TRIGGER.match(message.content):
+            stats["handled"] += 1
             await self.handle_dnd_query(message)
             return
 
-        # Role mention trigger (handles <@&ROLEID> tokens)
-        if message.role_mentions:
-            try:
-                guild_role_id = await self.config.guild(message.guild).dm_role_id()
-            except Exception:
-                guild_role_id = None
-
-            triggered = False
-            for role in message.role_mentions:
-                if guild_role_id:
-                    if role.id == guild_role_id:
-                        triggered = True
-                        break
-                else:
-                    if role.name.lower() == "dm":
-                        triggered = True
-                        break
-
-            if triggered:
-                parts = content.split(maxsplit=1)
-                remainder = ""
-                if parts:
-                    first = parts[0]
-                    if first.startswith("<@&") and first.endswith(">"):
-                        remainder = parts[1] if len(parts) > 1 else ""
-                    else:
-                        remainder = content
-                message.content = f"@dm {remainder}".strip()
-                await self.handle_dnd_query(message)
-                return
+        # Role mention trigger (handles <@&ROLEID> tokens); Red dispatches commands itself
+        if message.role_mentions and self.mentions_dm_role(message):
+            mention = ROLE_MENTION.match(message.content)
+            remainder = message.content[mention.end():] if mention else message.content
+            message.content = f"@dm {remainder.strip()}".strip()
+            stats["handled"] += 1
+            await self.handle_dnd_query(message)
+            return
+
+        stats["filtered"] += 1
 
-            await self.bot.process_commands(message)
+    def mentions_dm_role(self, message: discord.Message) -> bool:
+        """Whether the message mentions the guild's DM role (a role named "DM" if none is set)."""
+        role_id = self.dm_roles.get(message.guild.id)
+        if role_id:
+            return any(role.id == role_id for role in message.role_mentions)
+        return any(role.name.lower() == "dm" for role in message.role_mentions)
 
     # ---------- COMMANDS ----------
 
     @commands.command()
     async def resetcontext(self, ctx):
         """Reset this channel's DM conversation history."""
-        await self.config.channel(ctx.channel).context.set([])
+        async with self.conversations.lock(ctx.channel):
+            self.conversations.set(ctx.channel, [])
         await ctx.send("This channel's DM context has been reset.")
 
     @commands.command()
     async def recap(self, ctx):
-        """Summarize the current channel's D&D session."""
-        cleaned = await self.summarize_context(ctx.channel)
-        if cleaned:
-            await ctx.send("This channel's session has been summarized.")
+        """Show the current channel's D&D session summary."""
+        # A background fold may be about to produce a fresher summary
+        task = self.summary_tasks.get(ctx.channel.id)
+        if task and not task.done():
+            await asyncio.shield(task)
+
+        async with self.conversations.lock(ctx.channel):
+            context = await self.conversations.get(ctx.channel)
+            summary = self.latest_summary(context)
+            # First recap of a session that never crossed the threshold
+            if summary is None and len(context) >= SUMMARY_KEEP * 2:
+                summary = await self.summarize_context(ctx.channel)
+
+        if summary:
+            await self.send_long_message(ctx.channel, f"📝 **Session recap:** {summary}")
         else:
             await ctx.send("Not enough context to summarize yet.")
 
+    @commands.command()
+    @commands.guild_only()
+    @commands.admin_or_permissions(manage_guild=True)
+    async def setdmrole(self, ctx, role: discord.Role = None):
+        """Set the role whose mention asks the DM. Without a role, a role named "DM" is used."""
+        await self.config.guild(ctx.guild).dm_role_id.set(role.id if role else None)
+        if role:
+            self.dm_roles[ctx.guild.id] = role.id
+            await ctx.send(f"Mentioning {role.name} now asks the DM.")
+        else:
+            self.dm_roles.pop(ctx.guild.id, None)
+            await ctx.send('DM role cleared; mentioning a role named "DM" asks the DM.')
+
     @commands.command()
     @commands.is_owner()
     async def setapikey(self, ctx, key: str):
         """Set a single OpenRouter API key (replaces pool). Owner only."""
         await ctx.message.delete()
         await self.config.api_keys.set([key])
+        await self.size_admission()
         confirm = await ctx.send("API key saved to config.")
         await confirm.delete(delay=3)
 
@@ -884,6 +1660,7 @@ class AiDm(commands.Cog):
             return await ctx.send("This key is already in the pool.")
         keys.append(key)
         await self.config.api_keys.set(keys)
+        await self.size_admission()
         confirm = await ctx.send("Key added to the shared pool.")
         await confirm.delete(delay=3)
 
@@ -892,6 +1669,7 @@ class AiDm(commands.Cog):
     async def dropkeys(self, ctx):
         """Remove all OpenRouter API keys from the shared pool (owner only)."""
         await self.config.api_keys.set([])
+        await self.size_admission()
         await ctx.send("All OpenRouter keys have been removed from the pool.")
 
     @commands.command()
@@ -917,33 +1695,36 @@ class AiDm(commands.Cog):
             color=discord.Color.blue(),
         )
 
-        async with aiohttp.ClientSession() as session:
-            for i, key in enumerate(keys, 1):
-                masked_key = f"{key[:6]}...{key[-4:]}"
-                try:
-                    async with session.get(
-                        "https://openrouter.ai/api/v1/key",
-                        headers={"Authorization": f"Bearer {key}"}
-                    ) as response:
-                        data = await response.json()
-                        key_data = data.get("data", {})
-                        limit_remaining = key_data.get("limit_remaining", "N/A")
-                        limit_total = key_data.get("limit", "N/A")
-                        embed.add_field(
-                            name=f"Key {i}",
-                            value=(
-                                f"```\nKey: {masked_key}"
-                                f"\nRate Limit Remaining: {limit_remaining}"
-                                f"\nRate Limit Total: {limit_total}\n```"
-                            ),
-                            inline=True
-                        )
-                except Exception as e:
+        session = await self.get_session()
+        for i, key in enumerate(keys, 1):
+            masked_key = f"{key[:6]}...{key[-4:]}"
+            try:
+                async with session.get(
+                    "https://openrouter.ai/api/v1/key",
+                    headers={"Authorization": f"Bearer {key}"}
+                ) as response:
+                    data = await response.json()
+                    key_data = data.get("data", {})
+                    limit_remaining = key_data.get("limit_remaining", "N/A")
+                    limit_total = key_data.get("limit", "N/A")
+                    if isinstance(limit_remaining, (int, float)) or limit_remaining is None:
+                        # None means no credit limit on this key
+                        self.key_pool.set_limit_remaining(key, limit_remaining)
                     embed.add_field(
                         name=f"Key {i}",
-                        value=f"❌ Error: {str(e)}",
+                        value=(
+                            f"```\nKey: {masked_key}"
+                            f"\nRate Limit Remaining: {limit_remaining}"
+                            f"\nRate Limit Total: {limit_total}\n```"
+                        ),
                         inline=True
                     )
+            except Exception as e:
+                embed.add_field(
+                    name=f"Key {i}",
+                    value=f"❌ Error: {str(e)}",
+                    inline=True
+                )
 
         msg = await ctx.send(embed=embed)
         await msg.delete(delay=30)
@@ -951,8 +1732,312 @@ class AiDm(commands.Cog):
     @commands.command()
     @commands.is_owner()
     async def set5etoolsurl(self, ctx, url: str):
-        """Set the base URL for the 5etools data (e.g. http://host:5050/data)."""
+        """
+        Set the base URL for the 5etools data (e.g. http://host:5050/data).
+        A file:// URL reads a local data/ directory or zip instead (file:///srv/5etools.zip).
+        """
+        path = local_path(url)
+        if path is not None and not path.exists():
+            return await ctx.send(f"Nothing at `{path}`.")
         await self.config.fivetools_url.set(url)
         # Clear cache so new URL is used
         self.fivetools_cache.clear()
-        await ctx.send(f"5etools URL set to: `{url}`")
\ No newline at end of file
+        self.file_versions.clear()
+        await asyncio.to_thread(self.name_index.clear)
+        self.passage_index.clear()
+        self.render_cache.clear()
+        self.start_warmup()
+        await ctx.send(f"5etools URL set to: `{url}`")
+
+    @commands.group()
+    @commands.is_owner()
+    async def aidm(self, ctx):
+        """AiDm status and maintenance (owner only)."""
+
+    @aidm.command()
+    async def warmup(self, ctx, restart: bool = False):
+        """Show 5etools warm-up progress, or restart it with `restart: True`."""
+        if restart:
+            self.start_warmup()
+            return await ctx.send("5etools warm-up restarted.")
+
+        status = self.warmup_status
+        if not status:
+            return await ctx.send("5etools warm-up has not started yet.")
+
+        state = "running" if self.warming_up() else "finished"
+        lines = [
+            f"State: {state}",
+            f"Loaded: {status['loaded']}/{status['total']}",
+            f"Failed: {len(status['failed'])}",
+            f"Indexed entries: {len(self.name_index)}",
+        ]
+        if status["finished"]:
+            elapsed = (status["finished"] - status["started"]).total_seconds()
+            lines.append(f"Elapsed: {elapsed:.1f}s")
+        if status["failed"]:
+            lines.append("Failed files: " + ", ".join(status["failed"]))
+        if status.get("next_retry"):
+            lines.append(f"Next retry: {status['next_retry']:%H:%M:%S}")
+        await self.send_lines(ctx, lines)
+
+    @aidm.command()
+    async def reload(self, ctx):
+        """Re-check loaded 5etools files and reindex only the ones that changed."""
+        async with ctx.typing():
+            status = await self.reload_5etools()
+        if "skipped" in status:
+            return await ctx.send(f"Reload skipped: {status['skipped']}.")
+        lines = [
+            f"Checked: {status['checked']} files in {status['seconds']:.1f}s",
+            f"Changed: {', '.join(status['changed']) or 'none'}",
+        ]
+        if status["dependents"]:
+            lines.append(f"Copies re-resolved in: {', '.join(status['dependents'])}")
+        await self.send_lines(ctx, lines)
+
+    @aidm.command()
+    async def autoreload(self, ctx, minutes: int = None):
+        """Show or set how often loaded 5etools files are checked for changes (0 turns it off)."""
+        if minutes is None:
+            minutes = await self.config.reload_interval()
+            state = f"every {minutes} minutes" if minutes else "off"
+            last = self.reload_status.get("finished")
+            suffix = f" (last run {last:%Y-%m-%d %H:%M})" if last else ""
+            return await ctx.send(f"Auto-reload is {state}{suffix}.")
+        if minutes < 0:
+            return await ctx.send("Minutes can't be negative.")
+        await self.config.reload_interval.set(minutes)
+        self.start_autoreload(minutes)
+        await ctx.send(f"Auto-reload {'every ' + str(minutes) + ' minutes' if minutes else 'turned off'}.")
+
+    @aidm.command()
+    async def clearcache(self, ctx):
+        """Delete the on-disk 5etools cache; files are re-downloaded on next load."""
+        size = await asyncio.to_thread(self.file_cache.size)
+        await asyncio.to_thread(self.file_cache.clear)
+        await ctx.send(f"Deleted {size / 1024 / 1024:.1f} MB of cached 5etools files.")
+
+    @aidm.command()
+    async def http(self, ctx):
+        """Show shared HTTP session counters: connection reuse and request latency."""
+        lines = [
+            f"Timeouts: total {await self.config.http_timeout()}s, connect {await self.config.http_connect_timeout()}s",
+            f"Per-host connection limit: {await self.config.http_limit_per_host()}",
+        ]
+        lines.extend(self.http_stats.summary())
+        await self.send_lines(ctx, lines)
+
+    @aidm.command()
+    async def keys(self, ctx):
+        """Show per-key health: cooldowns, success rate, 429s, latency and remaining credit."""
+        keys = await self.pool_keys()
+        if not keys:
+            return await ctx.send("No API keys configured.")
+        await self.send_lines(ctx, self.key_pool.summary(keys))
+
+    @aidm.command()
+    async def queue(self, ctx, slots_per_key: int = None, channel_depth: int = None):
+        """Show model slot and channel queue stats, or set slots per key and the per-channel queue depth."""
+        if slots_per_key is not None:
+            if slots_per_key < 1 or (channel_depth is not None and channel_depth < 1):
+                return await ctx.send("Both values must be at least 1.")
+            await self.config.model_slots_per_key.set(slots_per_key)
+            await self.size_admission()
+            if channel_depth is not None:
+                await self.config.channel_queue_depth.set(channel_depth)
+                self.admission.max_queue = channel_depth
+            return await ctx.send(
+                f"Model slots: {self.admission.limit} ({slots_per_key} per key), "
+                f"channel queue depth: {self.admission.max_queue}."
+            )
+        await self.send_lines(ctx, self.admission.summary())
+
+    @aidm.command()
+    async def httptimeout(self, ctx, total: int, connect: int = 10):
+        """Set HTTP timeouts in seconds; the session is rebuilt with the new values."""
+        if total <= 0 or connect <= 0:
+            return await ctx.send("Timeouts must be positive.")
+        await self.config.http_timeout.set(total)
+        await self.config.http_connect_timeout.set(connect)
+        if self.session and not self.session.closed:
+            await self.session.close()
+        self.session = None
+        await ctx.send(f"HTTP timeouts set to {total}s total, {connect}s connect.")
+
+    @aidm.command()
+    async def stream(self, ctx, enabled: bool = None):
+        """Show or toggle streaming DM replies (edited in place as the model writes)."""
+        if enabled is None:
+            enabled = await self.config.stream_replies()
+            return await ctx.send(f"Streaming replies are {'on' if enabled else 'off'}.")
+        await self.config.stream_replies.set(enabled)
+        await ctx.send(f"Streaming replies turned {'on' if enabled else 'off'}.")
+
+    @aidm.command()
+    async def replycache(self, ctx, clear: bool = False):
+        """Show reply cache counters, or empty it with `clear: True`."""
+        if clear:
+            self.reply_cache.clear()
+            await self.save_reply_cache()
+            return await ctx.send("Reply cache cleared.")
+
+        cache = self.reply_cache
+        lookups = cache.hits + cache.misses
+        rate = cache.hits / lookups * 100 if lookups else 0.0
+        lines = [
+            f"Entries: {len(cache)}/{cache.max_entries}",
+            f"TTL: {cache.ttl}s",
+            f"Hits: {cache.hits}",
+            f"Misses: {cache.misses}",
+            f"Hit rate: {rate:.0f}%",
+        ]
+        await self.send_lines(ctx, lines)
+
+    @aidm.command()
+    async def replycachettl(self, ctx, seconds: int):
+        """Set how long cached rules answers stay valid (seconds)."""
+        if seconds < 0:
+            return await ctx.send("TTL can't be negative.")
+        await self.config.reply_cache_ttl.set(seconds)
+        self.reply_cache.ttl = seconds
+        await ctx.send(f"Reply cache TTL set to {seconds}s.")
+
+    @aidm.command()
+    async def routing(self, ctx):
+        """Show how 5etools lookups were routed by question category."""
+        stats = self.route_stats
+        # Both wait on the index lock, which a reload or a worker search may hold
+        indexed = await asyncio.to_thread(self.name_index.types)
+        duplicates = await asyncio.to_thread(self.name_index.duplicates)
+        lines = [
+            f"Exact name in the question: {stats['exact']} ({len(self.name_index.scanner)} names known)",
+            f"Fuzzy, answered in the question's categories: {stats['routed']}",
+            f"Fell back to a global search: {stats['fallback']}",
+            f"No category detected: {stats['unrouted']}",
+            f"Same-name entries behind a preferred source: {duplicates}",
+            f"_copy entries waiting for their parent: {self.name_index.pending_copies}",
+            "Categories: " + ", ".join(
+                f"{name} ({'loaded' if intent.types_for([name]) & indexed else 'not loaded'})"
+                for name in intent.CATEGORIES
+            ),
+        ]
+        await self.send_lines(ctx, lines)
+
+    @aidm.command()
+    async def memory(self, ctx):
+        """Compare the loaded 5etools records with the decoded JSON trees they replace."""
+        base = (await self.config.fivetools_url()).rstrip("/")
+        bundle = await self.get_bundle()
+        loaded = list(self.fivetools_cache.items())
+
+        def measure():
+            # The trees are rebuilt from the disk copies just for this report
+            tree_bytes = record_bytes = entries = measured = 0
+            for endpoint, records in loaded:
+                record_bytes += sum(r.nbytes() for r in records)
+                entries += len(records)
+                if bundle:
+                    raw = bundle.read_text(endpoint)
+                else:
+                    raw, _ = self.file_cache.load(endpoint, f"{base}/{endpoint}")
+                if raw is not None:
+                    tree_bytes += deep_sizeof(json.loads(raw))
+                    measured += 1
+            return tree_bytes, record_bytes, entries, measured
+
+        async with ctx.typing():
+            tree_bytes, record_bytes, entries, measured = await asyncio.to_thread(measure)
+
+        mb = 1024 * 1024
+        lines = [
+            f"Files loaded: {len(loaded)} ({entries} entries)",
+            f"Decoded JSON (before): {tree_bytes / mb:.1f} MB across {measured} files "
+            f"{'in the local bundle' if bundle else 'on disk'}",
+            f"Entry records (after): {record_bytes / mb:.1f} MB",
+        ]
+        if tree_bytes:
+            lines.append(f"Saved: {(1 - record_bytes / tree_bytes) * 100:.0f}%")
+        try:
+            with open("/proc/self/status", encoding="ascii") as status:
+                rss = next(line.split(":", 1)[1].strip() for line in status if line.startswith("VmRSS"))
+            lines.append(f"Process RSS: {rss}")
+        except (OSError, StopIteration):
+            pass
+        await self.send_lines(ctx, lines)
+
+    @aidm.command()
+    async def rendercache(self, ctx, size_kb: int = None):
+        """Show rendered-entry cache stats, or set its memory budget in KB."""
+        if size_kb is not None:
+            if size_kb < 0:
+                return await ctx.send("Size can't be negative.")
+            await self.config.render_cache_kb.set(size_kb)
+            self.render_cache.resize(size_kb * 1024)
+            return await ctx.send(f"Render cache budget set to {size_kb} KB.")
+        await self.send_lines(ctx, self.render_cache.summary())
+
+    @aidm.command()
+    async def contexts(self, ctx, flush: bool = False):
+        """Show the in-memory conversation store, or save it now with `flush: True`."""
+        if flush:
+            await self.conversations.flush()
+        lines = self.conversations.stats()
+        stats = self.summary_stats
+        running = sum(1 for task in self.summary_tasks.values() if not task.done())
+        avg = stats["seconds"] / stats["runs"] if stats["runs"] else 0
+        lines.append(
+            f"Summaries: {stats['runs']} ({stats['turns_folded']} turns folded, avg {avg:.1f}s), "
+            f"{stats['failed']} failed, {stats['stale']} discarded, {running} running"
+        )
+        await self.send_lines(ctx, lines)
+
+    @aidm.command()
+    async def prompt(self, ctx, budget: int = None):
+        """Show prompt token stats, or set the context token budget."""
+        if budget is not None:
+            if budget < 500:
+                return await ctx.send("Budget must be at least 500 tokens.")
+            await self.config.prompt_token_budget.set(budget)
+            return await ctx.send(f"Prompt token budget set to {budget}.")
+        lines = [f"Budget: {await self.config.prompt_token_budget()} tokens"]
+        lines.extend(self.prompt_stats.summary())
+        await self.send_lines(ctx, lines)
+
+    @aidm.command()
+    async def messages(self, ctx):
+        """Show how many messages the listener saw, filtered out and handed to the DM."""
+        stats = self.message_stats
+        lines = [
+            f"Seen: {stats['seen']}",
+            f"Filtered: {stats['filtered']}",
+            f"Handled: {stats['handled']}",
+            f"Guilds with a DM role set: {sum(1 for role_id in self.dm_roles.values() if role_id)}",
+        ]
+        await self.send_lines(ctx, lines)
+
+    @aidm.command()
+    async def reference(self, ctx, chars: int = None):
+        """Show rules-passage retrieval stats, or set the reference size cap in characters."""
+        if chars is not None:
+            if chars < 200:
+                return await ctx.send("The cap must be at least 200 characters.")
+            await self.config.reference_chars.set(chars)
+            return await ctx.send(f"Rules reference capped at {chars} characters.")
+        stats = self.reference_stats
+        avg = stats["chars"] / stats["attached"] if stats["attached"] else 0
+        lines = [
+            f"Indexed passages: {len(self.passage_index)}",
+            f"Cap: {await self.config.reference_chars()} characters",
+            f"Searches: {stats['searched']} ({stats['found']} with results)",
+            f"Prompts with a reference: {stats['attached']} (avg {avg:.0f} chars)",
+        ]
+        await self.send_lines(ctx, lines)
+
+    @aidm.command()
+    async def latency(self, ctx, reset: bool = False):
+        """Show p50/p90/p99 per query stage over recent turns, or clear them with `reset: True`."""
+        if reset:
+            self.tracer.reset()
+            return await ctx.send("Latency samples cleared.")
+        await self.send_lines(ctx, self.tracer.summary())
@@ -0,0 +1,598 @@
+"""
+Benchmarks for AiDm's 5etools hot paths.
+
+Run from the repo root:
+
+    python -m aidm.bench                      # synthetic corpus
+    python -m aidm.bench --data-dir ./data    # a local 5etools data/ checkout
+    python -m aidm.bench --out new.json --compare old.json
+
+The "cog" section loads the corpus into a real AiDm over HTTP from a local
+aiohttp stub and drives extract_keyword_fuzzy, search_5etools and
+format_5etools_entry with generated questions. `--out` saves every section
+as JSON (with the git commit), and `--compare` prints each metric next to
+an earlier run.
+"""
+
+import argparse
+import asyncio
+import difflib
+import json
+import logging
+import platform
+import random
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+from itertools import islice
+from pathlib import Path
+
+from .fulltext import FileIndex, PassageIndex
+from .index import NameIndex
+from .markup import hide_mechanics, render_markup
+from .records import deep_sizeof, project
+from .spans import percentile
+
+
+_PREFIXES = [
+    "Ancient", "Young", "Adult", "Greater", "Lesser", "Giant", "Dire", "Shadow", "Storm",
+    "Frost", "Fire", "Stone", "Iron", "Blood", "Spectral", "Arcane", "Mind", "Death",
+    "Elder", "Swarm of", "Wand of", "Staff of", "Ring of", "Cloak of", "Potion of",
+]
+_NOUNS = [
+    "Dragon", "Goblin", "Orc", "Troll", "Giant", "Wolf", "Spider", "Golem", "Elemental",
+    "Lich", "Wraith", "Knight", "Mage", "Priest", "Bolt", "Ball", "Shield", "Wall",
+    "Blade", "Protection", "Healing", "Invisibility", "Flight", "Resistance", "Sight",
+    "Hound", "Serpent", "Beholder", "Mephit", "Hag", "Zombie", "Skeleton", "Armor",
+]
+_SUFFIXES = ["", "", "", " Boss", " Chieftain", " Warlord", " Shaman", " +1", " +2", " of Doom"]
+
+
+# Real 5etools spell / monster strings (PHB Fireball, MM Goblin, ...)
+SAMPLE_MARKUP = [
+    "A bright streak flashes from your pointing finger to a point you choose within range and then blossoms "
+    "with a low roar into an explosion of flame. Each creature in a 20-foot-radius sphere centered on that point "
+    "must make a Dexterity saving throw. A target takes {@damage 8d6} fire damage on a failed save, or half as "
+    "much damage on a successful one.",
+    "When you cast this spell using a spell slot of 4th level or higher, the damage increases by {@scaledamage "
+    "8d6|3-9|1d6} for each slot level above 3rd.",
+    "{@atk mw} {@hit 4} to hit, reach 5 ft., one target. {@h}5 ({@damage 1d6 + 2}) slashing damage.",
+    "{@atk rw} {@hit 4} to hit, range 80/320 ft., one target. {@h}5 ({@damage 1d6 + 2}) piercing damage.",
+    "The goblin can take the {@action Disengage} or {@action Hide} action as a bonus action on each of its turns.",
+    "The dragon exhales fire in a 60-foot cone. Each creature in that area must make a {@dc 21} Dexterity saving "
+    "throw, taking 63 ({@damage 18d6}) fire damage on a failed save, or half as much damage on a successful one.",
+    "You can cast {@spell detect magic|phb} at will, and {@spell fireball|phb} and {@spell lightning bolt|phb} "
+    "once each per day. A creature {@condition frightened|phb} by it has {@quickref disadvantage|PHB|2|0} on rolls.",
+    "{@note If you cast {@spell counterspell|phb} on a spell of 4th level or higher, make a {@skill Arcana} check.}",
+    "Flurry of Blows|Monk||2",
+    "<$level$> + <$wis_mod$>",
+]
+
+SAMPLE_REPLIES = [
+    "The goblin lunges at you! Roll 1d20 = 14 against its AC. It needs a DC 13 Dexterity save to dodge the net; "
+    "it rolled 9. Beyond the door you sense something stronger, maybe CR 5, and your Perception roll: 17 reveals "
+    "tracks. What do you do next?",
+]
+
+
+def _old_clean(text: str) -> str:
+    """AiDm.clean_5etools_markup before the single-pass renderer, verbatim."""
+    if not isinstance(text, str):
+        return text
+
+    # Generic {@tag content|...} → content
+    text = re.sub(
+        r"\{@[a-zA-Z]+ ([^|}]+)(?:\|[^}]+)?\}",
+        r"\1",
+        text,
+    )
+
+    # Remove leftover |source|junk
+    text = re.sub(r"\|[a-zA-Z0-9]+", "", text)
+
+    # Remove any remaining {@...}
+    text = re.sub(r"\{@[^}]+\}", "", text)
+
+    return text.strip()
+
+
+def _old_format_string(value: str) -> str:
+    """The string branch of AiDm.format_value before the single-pass renderer, verbatim."""
+    cleaned = _old_clean(value).strip()
+
+    # Convert class feature pipes: "Feature|Monk||3" → "Feature (Level 3)"
+    cleaned = re.sub(r"\|[A-Za-z]+?\|\|(\d+)", r" (Level \1)", cleaned)
+
+    # Convert prepared spell formulas like "<$level$> + <$int_mod$>"
+    formula_map = {
+        "level": "level",
+        "int_mod": "INT modifier",
+        "wis_mod": "WIS modifier",
+        "cha_mod": "CHA modifier",
+        "str_mod": "STR modifier",
+        "dex_mod": "DEX modifier",
+        "con_mod": "CON modifier",
+    }
+
+    def replace_formula(match):
+        key = match.group(1)
+        return formula_map.get(key, key)
+
+    cleaned = re.sub(r"<\$(.*?)\$>", replace_formula, cleaned)
+
+    return cleaned
+
+
+def _old_hide(text: str) -> str:
+    """Pre-renderer AiDm.hide_mechanics."""
+    text = re.sub(r"\b(CR|DC)\s?(\d+)\b", r"||\1\2||", text)
+    text = re.sub(r"(\d+d\d+)\s*[:=]\s*(\d+)", r"||\1 = \2||", text)
+    return re.sub(r"\b[Rr]oll(?:ed)?[: ]+(\d+)\b", r"||Roll \1||", text)
+
+
+_STOP_WORDS = {
+    'a', 'an', 'the', 'and', 'or', 'but', 'if', 'while', 'with', 'to', 'from', 'in', 'on', 'at',
+    'by', 'for', 'of', 'up', 'down', 'out', 'over', 'under', 'again', 'further', 'then', 'once',
+    'here', 'there', 'when', 'where', 'why', 'how', 'all', 'any', 'both', 'each', 'few', 'more',
+    'most', 'other', 'some', 'such', 'no', 'nor', 'not', 'only', 'own', 'same', 'so', 'than',
+    'too', 'very', 'can', 'will', 'just', 'don', 'should', 'now', 'tell', 'me', 'about', 'what',
+    'is', 'are', 's'
+}
+
+_QUESTIONS = [
+    "what does {} do?",
+    "tell me about the {}",
+    "how does {} work in combat",
+    "can you explain {} to me",
+    "what is a {}",
+]
+
+
+def _old_extract_keyword(raw_text: str):
+    """AiDm.extract_keyword_fuzzy: the most common n-gram of non-stopwords, n = 3, 2, 1."""
+    words = re.findall(r'\b\w+\b', raw_text.lower())
+    filtered = [word for word in words if word not in _STOP_WORDS]
+    for n in (3, 2, 1):
+        ngrams = [' '.join(ng) for ng in zip(*(islice(filtered, i, None) for i in range(n)))]
+        if ngrams:
+            return Counter(ngrams).most_common(1)[0][0]
+    return None
+
+
+def make_questions(names: list, count: int = 300, seed: int = 11) -> list:
+    """(question, expected lowered name) pairs with the name spelled out."""
+    rng = random.Random(seed)
+    pairs = []
+    for _ in range(count):
+        name = rng.choice(names)
+        pairs.append((rng.choice(_QUESTIONS).format(name.lower()), name.lower()))
+    return pairs
+
+
+def bench_entities(files: dict, pairs: list, cutoff: float = 0.65) -> dict:
+    """Keyword extraction + fuzzy search against the exact entity scan, same questions."""
+    index = NameIndex()
+    for endpoint, records in files.items():
+        index.add_file(endpoint, records)
+
+    def fuzzy(question):
+        keyword = _old_extract_keyword(question)
+        entry, score = index.search(keyword) if keyword else (None, 0.0)
+        return entry if score >= cutoff else None
+
+    def scanned(question):
+        return index.find_in(question) or fuzzy(question)
+
+    results = {}
+    for label, func in (("fuzzy", fuzzy), ("scan", scanned)):
+        start = time.perf_counter()
+        found = [func(q) for q, _ in pairs]
+        results[f"{label}_ms_per_question"] = (time.perf_counter() - start) * 1000 / len(pairs)
+        results[f"{label}_accuracy"] = sum(
+            1 for entry, (_, name) in zip(found, pairs) if entry is not None and entry.key == name
+        ) / len(pairs)
+    return {"questions": len(pairs), **results}
+
+
+def harvest_strings(corpus: dict, limit: int = 20000) -> list:
+    """Collect entry strings containing markup from a loaded corpus."""
+    found = []
+
+    def walk(value):
+        if len(found) >= limit:
+            return
+        if isinstance(value, str):
+            if "{@" in value:
+                found.append(value)
+        elif isinstance(value, list):
+            for v in value:
+                walk(v)
+        elif isinstance(value, dict):
+            for v in value.values():
+                walk(v)
+
+    walk(corpus)
+    return found
+
+
+def _time_per_call(func, strings: list, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for text in strings:
+            func(text)
+    return (time.perf_counter() - start) * 1e6 / (repeat * len(strings))
+
+
+def bench_markup(strings: list, replies: list = SAMPLE_REPLIES, repeat: int = 200) -> dict:
+    """Time the chained-regex cleaners against the single-pass renderer."""
+    return {
+        "strings": len(strings),
+        "clean_old_us": _time_per_call(_old_clean, strings, repeat),
+        "clean_new_us": _time_per_call(render_markup, strings, repeat),
+        "format_old_us": _time_per_call(_old_format_string, strings, repeat),
+        "format_new_us": _time_per_call(lambda t: render_markup(t, formulas=True, features=True), strings, repeat),
+        "hide_old_us": _time_per_call(_old_hide, replies, repeat * 10),
+        "hide_new_us": _time_per_call(hide_mechanics, replies, repeat * 10),
+        "clean_identical": sum(_old_clean(t) == render_markup(t) for t in strings) / len(strings),
+        "format_identical": sum(
+            _old_format_string(t) == render_markup(t, formulas=True, features=True) for t in strings
+        ) / len(strings),
+    }
+
+
+def synthetic_corpus(size: int = 9000, files: int = 25, seed: int = 5) -> dict:
+    """Build {endpoint: data} shaped like 5etools files, with plausible entry names."""
+    rng = random.Random(seed)
+    corpus = {}
+    per_file = max(1, size // files)
+    for f in range(files):
+        entries = []
+        for _ in range(per_file):
+            name = f"{rng.choice(_PREFIXES)} {rng.choice(_NOUNS)}{rng.choice(_SUFFIXES)}"
+            if rng.random() < 0.3:
+                name = f"{rng.choice(_NOUNS)} {name}"
+            entries.append({
+                "name": name,
+                "source": "BENCH",
+                "page": rng.randrange(1, 400),
+                "level": rng.randrange(0, 10),
+                "range": {"type": "point", "distance": {"type": "feet", "amount": rng.choice([30, 60, 120])}},
+                "entries": [f"{name} does a thing.", *rng.sample(SAMPLE_MARKUP[:8], 2)],
+            })
+        corpus[f"bench/file-{f:02d}.json"] = {"entry": entries}
+    return corpus
+
+
+def load_data_dir(path: str) -> dict:
+    """Load every 5etools JSON file under a data directory, skipping fluff and indexes."""
+    corpus = {}
+    root = Path(path)
+    for file in sorted(root.rglob("*.json")):
+        rel = file.relative_to(root).as_posix()
+        name = file.name
+        if "fluff" in name or name.startswith(("index", "foundry")):
+            continue
+        try:
+            corpus[rel] = json.loads(file.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            continue
+    return corpus
+
+
+def make_queries(names: list, count: int = 300, seed: int = 7) -> list:
+    """Typos, truncations and near misses drawn from the corpus names."""
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(count):
+        name = rng.choice(names).lower()
+        kind = rng.random()
+        if kind < 0.25 or len(name) < 5:
+            queries.append(name)
+        elif kind < 0.5:
+            i = rng.randrange(len(name))
+            queries.append(name[:i] + name[i + 1:])
+        elif kind < 0.7:
+            i = rng.randrange(len(name) - 1)
+            queries.append(name[:i] + name[i + 1] + name[i] + name[i + 2:])
+        elif kind < 0.85:
+            queries.append(name[: max(3, len(name) * 2 // 3)])
+        else:
+            queries.append(f"{rng.choice(_NOUNS).lower()} {rng.choice(_NOUNS).lower()}")
+    return queries
+
+
+def linear_search(records: list, keyword: str):
+    """The pre-index AiDm.search_5etools loop, kept as the reference."""
+    best_entry, best_score = None, 0.0
+    for entry in records:
+        score = difflib.SequenceMatcher(None, keyword.lower(), entry.key).ratio()
+        if score > best_score:
+            best_score = score
+            best_entry = entry
+    return best_entry, best_score
+
+
+def bench_search(files: dict, queries: list, cutoff: float = 0.65) -> dict:
+    """Time the linear scan against NameIndex and count matching answers."""
+    all_entries = [r for records in files.values() for r in records]
+
+    start = time.perf_counter()
+    index = NameIndex()
+    for endpoint, records in files.items():
+        index.add_file(endpoint, records)
+    build = time.perf_counter() - start
+
+    def hit(result):
+        entry, score = result
+        return entry if entry is not None and score >= cutoff else None
+
+    start = time.perf_counter()
+    linear = [hit(linear_search(all_entries, q)) for q in queries]
+    linear_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    indexed = [hit(index.search(q)) for q in queries]
+    index_time = time.perf_counter() - start
+
+    agree = sum(1 for a, b in zip(linear, indexed) if a is b)
+    return {
+        "entries": len(index),
+        "queries": len(queries),
+        "index_build_ms": build * 1000,
+        "linear_ms_per_query": linear_time * 1000 / len(queries),
+        "index_ms_per_query": index_time * 1000 / len(queries),
+        "speedup": linear_time / index_time if index_time else float("inf"),
+        "agreement": agree / len(queries),
+    }
+
+
+def bench_memory(corpus: dict, files: dict) -> dict:
+    """Decoded JSON trees against the entry records that replace them."""
+    start = time.perf_counter()
+    for data in corpus.values():
+        project(data)
+    project_time = time.perf_counter() - start
+
+    tree = deep_sizeof(corpus)
+    records = sum(r.nbytes() for recs in files.values() for r in recs)
+    return {
+        "entries": sum(len(recs) for recs in files.values()),
+        "tree_mb": tree / (1024 * 1024),
+        "records_mb": records / (1024 * 1024),
+        "saved": 1 - records / tree if tree else 0.0,
+        "project_ms": project_time * 1000,
+    }
+
+
+def bench_fulltext(files: dict, questions: list) -> dict:
+    """Build the BM25 passage index and time searches for full questions."""
+    start = time.perf_counter()
+    index = PassageIndex()
+    for endpoint, records in files.items():
+        index.add_file(endpoint, FileIndex(records))
+    build = time.perf_counter() - start
+
+    latencies = []
+    start = time.perf_counter()
+    for question in questions:
+        t = time.perf_counter()
+        index.search(question)
+        latencies.append((time.perf_counter() - t) * 1000)
+    return {"passages": len(index), "build_ms": build * 1000, **_stage(latencies, time.perf_counter() - start)}
+
+
+def make_cog_questions(names: list, count: int = 300, seed: int = 13) -> list:
+    """Questions as players type them: names spelled out, misspelled or cut short."""
+    rng = random.Random(seed)
+    spelled = [q for q, _ in make_questions(names, count - count // 2, seed)]
+    sloppy = [rng.choice(_QUESTIONS).format(q) for q in make_queries(names, count // 2, seed)]
+    questions = spelled + sloppy
+    rng.shuffle(questions)
+    return questions
+
+
+def _stage(latencies: list, seconds: float) -> dict:
+    ordered = sorted(latencies)
+    return {
+        "ops_per_s": len(ordered) / seconds if seconds else 0.0,
+        "p50_ms": percentile(ordered, 50),
+        "p99_ms": percentile(ordered, 99),
+    }
+
+
+async def _serve_corpus(corpus: dict):
+    """Serve the corpus like a 5etools data/ directory on a free local port."""
+    from aiohttp import web
+
+    payloads = {endpoint: json.dumps(data).encode() for endpoint, data in corpus.items()}
+    listing = "".join(
+        f'<a href="{endpoint.split("/")[-1]}">{endpoint}</a>' for endpoint in payloads if endpoint.startswith("class/")
+    )
+
+    async def handler(request):
+        path = request.match_info["path"]
+        if path.rstrip("/") == "class":
+            return web.Response(text=f"<html><body>{listing}</body></html>", content_type="text/html")
+        if path not in payloads:
+            return web.Response(status=404)
+        return web.Response(body=payloads[path], content_type="application/json")
+
+    app = web.Application()
+    app.router.add_get("/data/{path:.*}", handler)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", 0).start()
+    host, port = runner.addresses[0][:2]
+    return runner, f"http://{host}:{port}/data"
+
+
+class _BenchBot:
+    """Just enough of Red for AiDm outside a running bot."""
+
+    def __init__(self):
+        self.loop = asyncio.get_running_loop()
+        self.user = None
+
+    async def wait_until_ready(self):
+        pass
+
+
+async def bench_cog(corpus: dict, questions: list) -> dict:
+    """
+    Load the corpus into AiDm from a local stub, then time each hot path per call:
+    extract_keyword_fuzzy on every question, search_5etools on every keyword and
+    format_5etools_entry on every entry found. Red's data path points at a
+    temporary directory unless one is configured already.
+    """
+    from redbot.core import data_manager
+
+    if not data_manager.basic_config or not data_manager.basic_config.get("DATA_PATH"):
+        data_manager.basic_config = {**data_manager.basic_config_default, "DATA_PATH": tempfile.mkdtemp()}
+    from .aidm import AiDm
+
+    logging.getLogger("red.aidm").setLevel(logging.WARNING)
+    runner, base = await _serve_corpus(corpus)
+    cog = AiDm(_BenchBot())
+    try:
+        cog.warmup_task.cancel()
+        await cog.config.fivetools_url.set(base)
+        cog.fivetools_files = [endpoint for endpoint in corpus if not endpoint.startswith("class/")]
+        await cog.cog_load()
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        cog.start_warmup()
+        await cog.warmup_task
+        warmup = time.perf_counter() - start
+        _, warmup_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        latencies, keywords = [], []
+        start = time.perf_counter()
+        for question in questions:
+            t = time.perf_counter()
+            keyword = cog.extract_keyword_fuzzy(question)
+            latencies.append((time.perf_counter() - t) * 1000)
+            if keyword:
+                keywords.append(keyword)
+        extract = _stage(latencies, time.perf_counter() - start)
+
+        latencies, found = [], []
+        start = time.perf_counter()
+        for keyword in keywords:
+            t = time.perf_counter()
+            entry = await cog.search_5etools(keyword)
+            latencies.append((time.perf_counter() - t) * 1000)
+            if entry is not None:
+                found.append(entry)
+        search = _stage(latencies, time.perf_counter() - start)
+
+        latencies = []
+        start = time.perf_counter()
+        for record in found:
+            t = time.perf_counter()
+            cog.format_5etools_entry(record.entry)
+            latencies.append((time.perf_counter() - t) * 1000)
+        fmt = _stage(latencies, time.perf_counter() - start)
+    finally:
+        await cog.cog_unload()
+        await runner.cleanup()
+
+    result = {
+        "files": len(cog.fivetools_cache),
+        "entries": len(cog.name_index),
+        "questions": len(questions),
+        "matched": len(found) / len(questions) if questions else 0.0,
+        "warmup_ms": warmup * 1000,
+        "warmup_peak_mb": warmup_peak / (1024 * 1024),
+    }
+    for label, stage in (("extract", extract), ("search", search), ("format", fmt)):
+        result.update({f"{label}_{key}": value for key, value in stage.items()})
+    # ru_maxrss is in KB on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    result["peak_rss_mb"] = rss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+    return result
+
+
+def _commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=Path(__file__).resolve().parent,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(old: dict, new: dict):
+    """Print every metric present in both runs with its relative change."""
+    print(f"{'metric':<34} {old.get('commit', '?'):>12} {new.get('commit', '?'):>12} {'change':>8}")
+    for section, metrics in new["results"].items():
+        before = old.get("results", {}).get(section, {})
+        for key, value in metrics.items():
+            if key not in before or not isinstance(value, (int, float)):
+                continue
+            was = before[key]
+            change = f"{(value - was) / was * 100:+.1f}%" if was else ""
+            print(f"{section + '.' + key:<34} {was:>12.3f} {value:>12.3f} {change:>8}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark AiDm 5etools lookups.")
+    parser.add_argument("--data-dir", help="local 5etools data/ directory (default: synthetic corpus)")
+    parser.add_argument("--queries", type=int, default=300)
+    parser.add_argument("--skip-cog", action="store_true", help="skip the end-to-end AiDm section")
+    parser.add_argument("--out", help="write the results as JSON to this file")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare against")
+    args = parser.parse_args(argv)
+
+    corpus = load_data_dir(args.data_dir) if args.data_dir else synthetic_corpus()
+    files = {endpoint: project(data) for endpoint, data in corpus.items()}
+    names = [r.name for records in files.values() for r in records]
+    if not names:
+        raise SystemExit("No named entries found.")
+    queries = make_queries(names, args.queries)
+
+    results = {}
+    results["search_5etools"] = report("search_5etools", bench_search(files, queries))
+    if results["search_5etools"]["agreement"] != 1.0:
+        raise SystemExit("NameIndex disagrees with the linear scan")
+    results["memory"] = report("memory", bench_memory(corpus, files))
+    results["entities"] = report("entities", bench_entities(files, make_questions(names, args.queries)))
+
+    results["fulltext"] = report("fulltext", bench_fulltext(files, make_cog_questions(names, args.queries)))
+
+    strings = harvest_strings(corpus) if args.data_dir else []
+    results["markup"] = report("markup", bench_markup(strings or SAMPLE_MARKUP))
+
+    if not args.skip_cog:
+        results["cog"] = report("cog", asyncio.run(bench_cog(corpus, make_cog_questions(names, args.queries))))
+
+    run = {
+        "commit": _commit(),
+        "python": platform.python_version(),
+        "corpus": args.data_dir or "synthetic",
+        "queries": args.queries,
+        "results": results,
+    }
+    if args.out:
+        Path(args.out).write_text(json.dumps(run, indent=2), encoding="utf-8")
+    if args.compare:
+        print()
+        compare(json.loads(Path(args.compare).read_text(encoding="utf-8")), run)
+
+
+def report(title: str, result: dict) -> dict:
+    print(f"{title}:")
+    for key, value in result.items():
+        print(f"  {key}: {value:.3f}" if isinstance(value, float) else f"  {key}: {value}")
+    return result
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+In-memory per-channel conversation state.
+
+Each channel's context list is loaded from Config the first time it is
+needed and then served from memory. Changes mark the channel dirty, and a
+background task writes dirty channels back to Config in batches; the cog
+flushes once more on unload. A lock per channel lets a whole turn (read
+context, ask the model, append the reply) run without another message in
+the same channel interleaving and losing a turn.
+"""
+
+import asyncio
+import logging
+
+log = logging.getLogger("red.aidm")
+
+
+class ConversationStore:
+    """Write-behind cache of `config.channel(...).context()`."""
+
+    def __init__(self, config, flush_interval: float = 30.0):
+        self.config = config
+        self.flush_interval = flush_interval
+        self._contexts = {}     # channel id -> context list
+        self._dirty = set()
+        self._locks = {}
+        self._task = None
+        self.flushes = 0
+        self.writes = 0
+
+    def lock(self, channel) -> asyncio.Lock:
+        """Lock serializing turns in one channel."""
+        return self._locks.setdefault(channel.id, asyncio.Lock())
+
+    async def get(self, channel) -> list:
+        """The channel's live context list, loaded from Config on first use."""
+        context = self._contexts.get(channel.id)
+        if context is None:
+            context = await self.config.channel(channel).context()
+            # Another coroutine may have loaded it while we awaited
+            context = self._contexts.setdefault(channel.id, context)
+        return context
+
+    def set(self, channel, context: list):
+        """Replace the channel's context; written to Config on the next flush."""
+        self._contexts[channel.id] = context
+        self._dirty.add(channel.id)
+
+    async def flush(self):
+        """Write every dirty channel to Config."""
+        dirty, self._dirty = self._dirty, set()
+        for channel_id in dirty:
+            try:
+                await self.config.channel_from_id(channel_id).context.set(self._contexts[channel_id])
+                self.writes += 1
+            except Exception as e:
+                # Keep it dirty so the next flush retries
+                self._dirty.add(channel_id)
+                log.warning("Failed to save context for channel %s: %s", channel_id, e)
+        if dirty:
+            self.flushes += 1
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        """Cancel the timer and do a final flush."""
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def stats(self) -> list:
+        """Channels held, unsaved channels and flush counts."""
+        return [
+            f"Channels in memory: {len(self._contexts)}",
+            f"Unsaved channels: {len(self._dirty)}",
+            f"Flushes: {self.flushes} ({self.writes} channel writes)",
+            f"Flush interval: {self.flush_interval:.0f}s",
+        ]
@@ -0,0 +1,140 @@
+"""
+5etools `_copy` inheritance.
+
+Many 5etools entries are stubs that say "start from this other entry and
+change a few things":
+
+    {"name": "Goblin Boss", "source": "XYZ",
+     "_copy": {"name": "Goblin", "source": "MM",
+               "_mod": {"action": {"mode": "appendArr", "items": {...}}}}}
+
+merge_copy builds the full entry from the parent once, at load time: the
+parent's fields minus the ones that describe the parent's own publication,
+then the stub's own fields, then the `_mod` operations in order. The
+operations 5etools data uses most are supported; anything else is left
+unapplied rather than guessed at.
+"""
+
+import copy
+import re
+
+# Parent fields about the parent's own printing, not inherited unless `_preserve`d
+NOT_INHERITED = frozenset({
+    "_versions", "page", "otherSources", "additionalSources", "reprintedAs", "isReprinted",
+    "srd", "srd52", "basicRules", "basicRules2024", "hasFluff", "hasFluffImages", "hasToken",
+    "tokenUrl", "altArt", "legacy",
+})
+
+_JS_GROUP = re.compile(r"\$(\d+|&)")
+
+
+def _replacement(js: str) -> str:
+    """A JavaScript replacement string ("$1", "$&") in re.sub syntax."""
+    js = js.replace("\\", "\\\\")
+    return _JS_GROUP.sub(lambda m: r"\g<0>" if m.group(1) == "&" else rf"\g<{m.group(1)}>", js)
+
+
+def _replace_text(value, pattern, repl):
+    """Apply a regex replacement to every string in a nested entries structure."""
+    if isinstance(value, str):
+        return pattern.sub(repl, value)
+    if isinstance(value, list):
+        return [_replace_text(v, pattern, repl) for v in value]
+    if isinstance(value, dict):
+        # Only entry text, not type tags or names
+        return {k: _replace_text(v, pattern, repl) if k in ("entries", "items", "entry") else v
+                for k, v in value.items()}
+    return value
+
+
+def _as_list(value) -> list:
+    return value if isinstance(value, list) else [value]
+
+
+def _name(item):
+    return item.get("name") if isinstance(item, dict) else item
+
+
+def _index_of(items: list, target) -> int:
+    """Position of an array item named (or equal to) `target`, or -1."""
+    if isinstance(target, dict) and "index" in target:
+        return target["index"] if 0 <= target["index"] < len(items) else -1
+    for i, item in enumerate(items):
+        if item == target or (_name(item) is not None and _name(item) == target):
+            return i
+    return -1
+
+
+def _apply_array(items: list, op: dict) -> list:
+    mode = op["mode"]
+    new = _as_list(op.get("items", []))
+    if mode == "appendArr":
+        return items + new
+    if mode == "prependArr":
+        return new + items
+    if mode == "appendIfNotExistsArr":
+        return items + [i for i in new if i not in items]
+    if mode == "insertArr":
+        at = op.get("index", len(items))
+        return items[:at] + new + items[at:]
+    if mode in ("replaceArr", "replaceOrAppendArr"):
+        at = _index_of(items, op.get("replace"))
+        if at < 0:
+            return items + new if mode == "replaceOrAppendArr" else items
+        return items[:at] + new + items[at + 1:]
+    if mode == "removeArr":
+        drop = _as_list(op.get("names", op.get("items", [])))
+        return [i for i in items if _name(i) not in drop and i not in drop]
+    return items
+
+
+def _set_prop(entry: dict, path: str, value):
+    *parents, last = path.split(".")
+    target = entry
+    for key in parents:
+        target = target.setdefault(key, {})
+    target[last] = copy.deepcopy(value)
+
+
+def _add_senses(entry: dict, op: dict):
+    senses = list(entry.get("senses") or [])
+    for sense in _as_list(op.get("senses", [])):
+        kind = sense.get("type", "")
+        text = f"{kind} {sense.get('range', 0)} ft."
+        if not any(isinstance(s, str) and s.startswith(kind) for s in senses):
+            senses.append(text)
+    entry["senses"] = senses
+
+
+def apply_mods(entry: dict, mods: dict) -> dict:
+    """Apply a `_mod` block to an entry in place and return it."""
+    for prop, ops in mods.items():
+        for op in _as_list(ops):
+            if isinstance(op, str):
+                op = {"mode": op}
+            mode = op.get("mode", "")
+            if mode == "replaceTxt":
+                flags = re.IGNORECASE if "i" in op.get("flags", "") else 0
+                pattern = re.compile(op["replace"], flags)
+                repl = _replacement(op.get("with", ""))
+                props = [k for k, v in entry.items() if isinstance(v, list)] if prop == "*" else [prop]
+                for key in props:
+                    if key in entry:
+                        entry[key] = _replace_text(entry[key], pattern, repl)
+            elif mode.endswith("Arr") and prop not in ("_", "*"):
+                entry[prop] = _apply_array(list(entry.get(prop) or []), op)
+            elif mode == "setProp":
+                _set_prop(entry, op["prop"], op.get("value"))
+            elif mode == "addSenses":
+                _add_senses(entry, op)
+    return entry
+
+
+def merge_copy(parent: dict, child: dict) -> dict:
+    """The full entry a `_copy` stub describes, given its parent entry."""
+    meta = child.get("_copy") or {}
+    keep = set(meta.get("_preserve") or ())
+    merged = {k: v for k, v in parent.items() if k not in NOT_INHERITED or k in keep or "*" in keep}
+    merged.pop("_copy", None)
+    merged.update((k, v) for k, v in child.items() if k != "_copy")
+    return apply_mods(merged, meta.get("_mod") or {})
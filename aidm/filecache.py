@@ -0,0 +1,71 @@
+"""
+On-disk cache of 5etools files.
+
+Each file is stored as the raw bytes the backend sent, next to a small
+meta file holding the source URL and its ETag / Last-Modified validators,
+so the next start can revalidate with a conditional GET.
+"""
+
+import hashlib
+import json
+import shutil
+from pathlib import Path
+
+
+def content_hash(raw: bytes) -> str:
+    """Digest used to tell a re-sent but unchanged file from a changed one."""
+    return hashlib.sha256(raw).hexdigest()
+
+
+class FileCache:
+    """Raw 5etools JSON plus HTTP validators under the cog's data path."""
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+
+    def _paths(self, endpoint: str):
+        data_path = self.root / endpoint
+        return data_path, data_path.with_name(data_path.name + ".meta")
+
+    def load(self, endpoint: str, url: str):
+        """Return (raw bytes, meta) cached for this exact URL, or (None, None)."""
+        data_path, meta_path = self._paths(endpoint)
+        try:
+            meta = json.loads(meta_path.read_text(encoding="utf-8"))
+            if meta.get("url") != url:
+                return None, None
+            return data_path.read_bytes(), meta
+        except (OSError, ValueError):
+            return None, None
+
+    def save(self, endpoint: str, raw: bytes, meta: dict):
+        """Write a file and its meta; the meta goes last so a torn write is never trusted."""
+        data_path, meta_path = self._paths(endpoint)
+        data_path.parent.mkdir(parents=True, exist_ok=True)
+        meta_path.unlink(missing_ok=True)
+        tmp = data_path.with_name(data_path.name + ".tmp")
+        tmp.write_bytes(raw)
+        tmp.replace(data_path)
+        meta_path.write_text(json.dumps(meta), encoding="utf-8")
+
+    def size(self) -> int:
+        """Total bytes on disk."""
+        if not self.root.exists():
+            return 0
+        return sum(p.stat().st_size for p in self.root.rglob("*") if p.is_file())
+
+    def clear(self):
+        """Delete everything on disk."""
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    @staticmethod
+    def conditional_headers(meta: dict) -> dict:
+        """If-None-Match / If-Modified-Since headers for a cached file."""
+        headers = {}
+        if not meta:
+            return headers
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+        return headers
@@ -0,0 +1,220 @@
+"""
+BM25 full-text retrieval over 5etools entry bodies.
+
+Each entry is cut into passages along the lines the entry formatter
+already renders: every paragraph or named block of `entries` (plus a
+spell's "At Higher Levels"), and every trait, action, bonus action,
+reaction and legendary action. Passages are indexed per file in compact
+postings (passage ids and term counts in arrays), built in a worker thread
+when the file loads, so adding or replacing a file never touches the
+others. Only locations are stored; the text of the few passages a search
+returns is re-extracted from their records.
+
+Scores are Okapi BM25 with corpus-wide document frequencies. Terms that
+occur in more than a quarter of all passages are skipped when the query
+has rarer ones, which keeps a search in the low milliseconds.
+
+A passage's `share` is its score over the idf of every query term that
+counted, including terms no passage contains: about 1.0 when a passage of
+average length mentions each of them once. A search can drop passages
+below a minimum share, so a question that only brushes the rules text
+gets nothing back.
+"""
+
+import heapq
+import math
+import re
+from array import array
+from collections import Counter, defaultdict, namedtuple
+
+from .index import SearchCancelled
+from .markup import render_markup
+
+K1 = 1.2
+B = 0.75
+COMMON_TERM_SHARE = 0.25
+
+TEXT_KEYS = ("entries", "entriesHigherLevel")
+ACTION_KEYS = (
+    "trait", "action", "actions", "bonus", "bonusActions", "reaction", "reactions",
+    "legendary", "legendaryActions", "mythic",
+)
+
+STOP_WORDS = frozenset({
+    "a", "an", "the", "and", "or", "but", "if", "of", "to", "in", "on", "at", "by", "for", "from",
+    "with", "as", "is", "are", "be", "it", "its", "this", "that", "these", "those", "can", "you",
+    "your", "i", "me", "my", "we", "do", "does", "what", "how", "when", "which", "who", "there",
+    "their", "they", "them", "has", "have", "was", "were", "will", "would", "not", "no", "so",
+    "about", "into", "than", "then", "also", "any", "each", "other", "tell", "dm", "much", "many",
+})
+
+_WORD = re.compile(r"[a-z0-9]+")
+
+Passage = namedtuple("Passage", "record heading text score share")
+
+
+def tokenize(text: str) -> list:
+    """Lowercase words worth indexing: no stop words or single letters."""
+    return [w for w in _WORD.findall(text.lower()) if len(w) > 1 and w not in STOP_WORDS]
+
+
+def _strings(value):
+    """Every string in nested entries, lists and list items, in reading order."""
+    if isinstance(value, str):
+        yield value
+    elif isinstance(value, list):
+        for item in value:
+            yield from _strings(item)
+    elif isinstance(value, dict):
+        for key in ("entries", "items", "entry"):
+            if key in value:
+                yield from _strings(value[key])
+
+
+def _block(name: str, block):
+    """(heading, text) for one top-level block, or None if it has no text."""
+    if isinstance(block, str):
+        return name, render_markup(block)
+    if not isinstance(block, dict):
+        return None
+    text = " ".join(render_markup(s) for s in _strings(block))
+    if not text:
+        return None
+    title = block.get("name")
+    return (f"{name}: {render_markup(title)}" if isinstance(title, str) else name), text
+
+
+def extract_passages(entry: dict) -> list:
+    """(heading, text) pairs for an entry's rules text, in a fixed order."""
+    name = entry.get("name", "")
+    found = []
+    for key in TEXT_KEYS + ACTION_KEYS:
+        blocks = entry.get(key)
+        if not isinstance(blocks, list):
+            continue
+        for block in blocks:
+            passage = _block(name, block)
+            if passage is not None:
+                found.append(passage)
+    return found
+
+
+class FileIndex:
+    """Postings for the passages of one file's records."""
+
+    __slots__ = ("records", "ordinals", "lengths", "total", "postings")
+
+    def __init__(self, records: list):
+        self.records = []               # passage id -> record
+        self.ordinals = array("H")      # passage id -> position in extract_passages(record.entry)
+        self.lengths = array("H")       # passage id -> tokens
+        self.total = 0
+        postings = defaultdict(lambda: (array("I"), array("H")))
+        for record in records:
+            for ordinal, (heading, text) in enumerate(extract_passages(record.entry)):
+                tokens = tokenize(f"{heading} {text}")
+                if not tokens:
+                    continue
+                pid = len(self.records)
+                self.records.append(record)
+                self.ordinals.append(min(ordinal, 0xFFFF))
+                self.lengths.append(min(len(tokens), 0xFFFF))
+                self.total += len(tokens)
+                for term, tf in Counter(tokens).items():
+                    ids, counts = postings[term]
+                    ids.append(pid)
+                    counts.append(min(tf, 0xFFFF))
+        self.postings = dict(postings)
+
+
+class PassageIndex:
+    """BM25 search over every loaded file's passages."""
+
+    def __init__(self):
+        self._files = {}        # endpoint -> FileIndex
+
+    def __len__(self):
+        return sum(len(f.records) for f in list(self._files.values()))
+
+    def add_file(self, endpoint: str, built: FileIndex):
+        """Install a file's passages, replacing any earlier build."""
+        self._files[endpoint] = built
+
+    def replace_files(self, built: dict):
+        """Install several files' passages in one step; searches see all of them or none."""
+        self._files = {**self._files, **built}
+
+    def clear(self):
+        self._files.clear()
+
+    def search(self, query: str, limit: int = 3, cancel=None, min_share: float = 0.0) -> list:
+        """
+        The best `limit` passages for a query scoring at least `min_share`,
+        at most one per record, as Passage tuples. Safe to run in a worker
+        thread while files change; raises SearchCancelled once `cancel` is set.
+        """
+        files = list(self._files.values())
+        count = sum(len(f.records) for f in files)
+        terms = set(tokenize(query))
+        if not count or not terms:
+            return []
+
+        avgdl = sum(f.total for f in files) / count
+        df = {t: sum(len(f.postings[t][0]) for f in files if t in f.postings) for t in terms}
+        known = [t for t in terms if df[t]]
+        rare = [t for t in known if df[t] <= count * COMMON_TERM_SHARE]
+        idf = {t: math.log(1 + (count - df[t] + 0.5) / (df[t] + 0.5)) for t in rare or known}
+        # Unknown terms score nothing but still count toward the mass a passage is measured against
+        mass = sum(idf.values()) + (len(terms) - len(known)) * math.log(1 + (count + 0.5) / 0.5)
+        floor = min_share * mass
+
+        # tf * (K1 + 1) / (tf + K1 * (1 - B + B * length / avgdl)), with the constants hoisted
+        base, per_token = K1 * (1 - B), K1 * B / avgdl
+        best = []
+        for f in files:
+            if cancel is not None and cancel.is_set():
+                raise SearchCancelled()
+            scores = defaultdict(float)
+            lengths = f.lengths
+            for term, weight in idf.items():
+                posting = f.postings.get(term)
+                if posting is None:
+                    continue
+                weight *= K1 + 1
+                for pid, tf in zip(*posting):
+                    scores[pid] += weight * tf / (tf + base + per_token * lengths[pid])
+            # A few extra per file so one-per-record can still fill `limit`
+            for pid in heapq.nlargest(limit * 3, scores, key=scores.get):
+                best.append((scores[pid], f, pid))
+
+        found, seen = [], set()
+        for score, f, pid in sorted(best, key=lambda hit: -hit[0]):
+            if score < floor or score <= 0:
+                break
+            record = f.records[pid]
+            if id(record) in seen:
+                continue
+            seen.add(id(record))
+            passages = extract_passages(record.entry)
+            ordinal = f.ordinals[pid]
+            if ordinal < len(passages):
+                heading, text = passages[ordinal]
+                found.append(Passage(record, heading, text, score, score / mass))
+            if len(found) == limit:
+                break
+        return found
+
+
+def format_reference(passages: list, max_chars: int) -> str:
+    """Passages as a rules-reference block of at most `max_chars`, best first."""
+    lines = []
+    used = 0
+    for passage in passages:
+        label = f"[{passage.heading} ({passage.record.source})] " if passage.record.source else f"[{passage.heading}] "
+        room = max_chars - used - len(label)
+        if room < 80:
+            break
+        text = passage.text if len(passage.text) <= room else passage.text[:room - 1].rstrip() + "…"
+        lines.append(label + text)
+        used += len(lines[-1]) + 1
+    return "\n".join(lines)
@@ -0,0 +1,89 @@
+"""
+Shared HTTP session for AiDm.
+
+One long-lived aiohttp session with keep-alive pooling and DNS caching,
+plus trace hooks that count reused connections and request latency.
+"""
+
+import time
+from collections import defaultdict
+
+import aiohttp
+
+
+class HttpStats:
+    """Connection reuse and per-host latency counters fed by aiohttp tracing."""
+
+    def __init__(self):
+        self.new_connections = 0
+        self.reused_connections = 0
+        self.requests = defaultdict(int)        # host -> count
+        self.errors = defaultdict(int)          # host -> count
+        self.total_latency = defaultdict(float) # host -> seconds
+        self.max_latency = defaultdict(float)   # host -> seconds
+
+    @property
+    def handshakes_saved(self) -> int:
+        """Requests that rode an already-open connection instead of a new TCP/TLS handshake."""
+        return self.reused_connections
+
+    def record(self, host: str, elapsed: float, failed: bool = False):
+        self.requests[host] += 1
+        self.total_latency[host] += elapsed
+        self.max_latency[host] = max(self.max_latency[host], elapsed)
+        if failed:
+            self.errors[host] += 1
+
+    def trace_config(self) -> aiohttp.TraceConfig:
+        trace = aiohttp.TraceConfig()
+
+        async def on_request_start(session, ctx, params):
+            ctx.start = time.perf_counter()
+
+        async def on_request_end(session, ctx, params):
+            self.record(params.url.host, time.perf_counter() - ctx.start)
+
+        async def on_request_exception(session, ctx, params):
+            self.record(params.url.host, time.perf_counter() - ctx.start, failed=True)
+
+        async def on_connection_create_end(session, ctx, params):
+            self.new_connections += 1
+
+        async def on_connection_reuseconn(session, ctx, params):
+            self.reused_connections += 1
+
+        trace.on_request_start.append(on_request_start)
+        trace.on_request_end.append(on_request_end)
+        trace.on_request_exception.append(on_request_exception)
+        trace.on_connection_create_end.append(on_connection_create_end)
+        trace.on_connection_reuseconn.append(on_connection_reuseconn)
+        return trace
+
+    def summary(self) -> list:
+        """Connection reuse, then requests, errors and latency per host."""
+        lines = [
+            f"Connections opened: {self.new_connections}",
+            f"Handshakes saved: {self.handshakes_saved}",
+        ]
+        for host, count in sorted(self.requests.items()):
+            avg = self.total_latency[host] / count * 1000
+            peak = self.max_latency[host] * 1000
+            lines.append(f"{host}: {count} req, {self.errors[host]} err, avg {avg:.0f} ms, max {peak:.0f} ms")
+        return lines
+
+
+def make_session(stats: HttpStats, total_timeout: float, connect_timeout: float,
+                 limit: int = 100, limit_per_host: int = 8) -> aiohttp.ClientSession:
+    """Build the pooled session. Must be called from within the running loop."""
+    connector = aiohttp.TCPConnector(
+        limit=limit,
+        limit_per_host=limit_per_host,
+        ttl_dns_cache=300,
+        keepalive_timeout=60,
+    )
+    timeout = aiohttp.ClientTimeout(total=total_timeout, connect=connect_timeout)
+    return aiohttp.ClientSession(
+        connector=connector,
+        timeout=timeout,
+        trace_configs=[stats.trace_config()],
+    )
@@ -0,0 +1,340 @@
+"""
+Fuzzy name index for 5etools entry records.
+
+Distinct entry names are broken into padded character trigrams and stored
+in postings lists, so a lookup only runs difflib on the names that share
+at least one trigram with the keyword instead of on every entry. They are
+scored most-shared first, so the best score rises early and difflib's cheap
+upper bounds skip almost all of the rest. A search can
+be limited to some record types (spells, monsters, ...), in which case
+only names carried by a record of those types are candidates. Names are
+also kept in an EntityScanner so a question that spells out a known name
+can be answered without any fuzzy matching.
+
+When several records share a name (the same spell in two books, a stub
+and its resolved copy), they are kept in `rank` order, so lookups return
+the preferred one no matter which file loaded first. `_copy` stubs are
+resolved against their parent record as soon as both are indexed.
+
+Lookups and file changes both run in worker threads, so everything that
+reads or writes the index structures takes one lock (len() reads a
+counter instead); a lookup can be given a threading.Event and stops with
+SearchCancelled once it is set.
+"""
+
+import difflib
+import threading
+from collections import defaultdict
+
+from .copies import merge_copy
+from .scanner import EntityScanner
+
+
+# Candidates scored between checks of a lookup's cancel event
+CANCEL_CHECK_EVERY = 32
+
+
+class SearchCancelled(Exception):
+    """A lookup was cancelled through its cancel event."""
+
+
+def trigrams(text: str) -> set:
+    """Return the set of padded character trigrams for a lowercased string."""
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class NameIndex:
+    """Trigram postings over entry names, built once per loaded 5etools file."""
+
+    def __init__(self, rank=None):
+        self._rank = rank or (lambda record: 0)
+        self._entries = []      # entry id -> EntryRecord (None once removed)
+        self._count = 0         # records indexed, so len() needs neither the lock nor a walk
+        self._files = {}        # endpoint -> list of entry ids
+        self._sources = {}      # id(record) -> endpoint
+        self._names = []        # name id -> lowercased name (None once unused)
+        self._name_ids = {}     # lowercased name -> name id
+        self._owners = []       # name id -> entry ids carrying that name, best rank (then oldest) first
+        self._pending = set()   # entry ids of _copy stubs not resolved yet
+        self._copied_from = {}  # entry id of a resolved copy -> endpoint its parent came from
+        self._postings = defaultdict(list)  # trigram -> list of name ids
+        self._typed = defaultdict(set)      # record type -> name ids with a record of that type
+        self.scanner = EntityScanner()
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, endpoint: str):
+        return endpoint in self._files
+
+    def add_file(self, endpoint: str, records: list):
+        """Index a file's entry records. Re-adding a file replaces it."""
+        with self._lock:
+            self._add_file(endpoint, records)
+
+    def _add_file(self, endpoint: str, records: list):
+        if endpoint in self._files:
+            self._remove_file(endpoint)
+
+        ids = []
+        for record in records:
+            entry_id = len(self._entries)
+            self._entries.append(record)
+            self._sources[id(record)] = endpoint
+            ids.append(entry_id)
+
+            lowered = record.key
+            name_id = self._name_ids.get(lowered)
+            if name_id is None:
+                name_id = len(self._names)
+                self._names.append(lowered)
+                self._name_ids[lowered] = name_id
+                self._owners.append([])
+                for gram in trigrams(lowered):
+                    self._postings[gram].append(name_id)
+                self.scanner.add(lowered)
+            self._owners[name_id].append(entry_id)
+            self._owners[name_id].sort(key=self._owner_key)
+            self._typed[record.type].add(name_id)
+            if record.copy_of is not None:
+                self._pending.add(entry_id)
+        self._files[endpoint] = ids
+        self._count += len(ids)
+
+    def _remove_file(self, endpoint: str):
+        ids = self._files.pop(endpoint, ())
+        if not ids:
+            return
+        self._count -= len(ids)
+
+        dropped = set()
+        for entry_id in ids:
+            record = self._entries[entry_id]
+            self._entries[entry_id] = None  # keep ids stable
+            self._pending.discard(entry_id)
+            self._copied_from.pop(entry_id, None)
+            self._sources.pop(id(record), None)
+            name_id = self._name_ids[record.key]
+            owners = self._owners[name_id]
+            owners.remove(entry_id)
+            if not any(self._entries[i].type == record.type for i in owners):
+                self._typed[record.type].discard(name_id)
+            if not owners:
+                dropped.add(name_id)
+
+        grams = set()
+        for name_id in dropped:
+            grams |= trigrams(self._names[name_id])
+            self.scanner.remove(self._names[name_id])
+            del self._name_ids[self._names[name_id]]
+            self._names[name_id] = None
+        for gram in grams:
+            postings = [i for i in self._postings.get(gram, ()) if i not in dropped]
+            if postings:
+                self._postings[gram] = postings
+            else:
+                self._postings.pop(gram, None)
+
+    def clear(self):
+        """Forget every indexed file."""
+        with self._lock:
+            self._count = 0
+            self._entries.clear()
+            self._files.clear()
+            self._sources.clear()
+            self._names.clear()
+            self._name_ids.clear()
+            self._owners.clear()
+            self._pending.clear()
+            self._copied_from.clear()
+            self._postings.clear()
+            self._typed.clear()
+            self.scanner.clear()
+
+    def _owner_key(self, entry_id: int):
+        return self._rank(self._entries[entry_id]), entry_id
+
+    @property
+    def pending_copies(self) -> int:
+        return len(self._pending)
+
+    def duplicates(self) -> int:
+        """Records hidden behind a better-ranked record of the same name and type."""
+        with self._lock:
+            hidden = 0
+            for owners in self._owners:
+                types = [self._entries[i].type for i in owners]
+                hidden += len(types) - len(set(types))
+            return hidden
+
+    def _exact(self, type: str, key: str, source: str):
+        """The indexed record with this type, lowered name and source (any source if empty)."""
+        name_id = self._name_ids.get(key)
+        if name_id is None:
+            return None
+        for entry_id in self._owners[name_id]:
+            record = self._entries[entry_id]
+            if record.type == type and (not source or record.source.lower() == source.lower()):
+                return record
+        return None
+
+    def resolve_copies(self) -> list:
+        """
+        Merge every `_copy` stub whose parent is indexed and itself complete,
+        replacing the stub's body in place; chains resolve over several
+        rounds. The lock is held throughout, so lookups never see a chain
+        half resolved. A stub whose `_mod` can't be applied stays a stub.
+        Returns the records changed.
+        """
+        resolved = []
+        with self._lock:
+            while True:
+                ready = []
+                for entry_id in self._pending:
+                    record = self._entries[entry_id]
+                    parent = self._exact(*record.copy_of)
+                    if parent is not None and parent is not record and parent.copy_of is None:
+                        ready.append((entry_id, record, parent))
+                if not ready:
+                    return resolved
+
+                for entry_id, record, parent in ready:
+                    self._pending.discard(entry_id)
+                    try:
+                        entry = merge_copy(parent.entry, record.entry)
+                    except Exception:
+                        continue    # malformed _mod
+                    record.set_entry(entry)
+                    self._owners[self._name_ids[record.key]].sort(key=self._owner_key)
+                    self._copied_from[entry_id] = self._sources.get(id(parent))
+                    resolved.append(record)
+
+    def dependents(self, endpoints) -> set:
+        """Files holding resolved copies of records from any of `endpoints` (besides those)."""
+        with self._lock:
+            return {
+                self._sources[id(self._entries[entry_id])]
+                for entry_id, parent in self._copied_from.items()
+                if parent in endpoints
+            } - set(endpoints)
+
+    def replace_files(self, files: dict) -> list:
+        """
+        Swap in new records for several files and resolve copies, all under
+        one hold of the lock: a concurrent lookup sees the old files or the
+        new ones, never a mix or an unresolved stub. Returns the records resolved.
+        """
+        with self._lock:
+            for endpoint, records in files.items():
+                self._add_file(endpoint, records)
+            return self.resolve_copies()
+
+    def source_of(self, record):
+        """Endpoint of the file an indexed record came from, or None."""
+        return self._sources.get(id(record))
+
+    def types(self) -> set:
+        """Record types currently indexed."""
+        with self._lock:
+            return {t for t, names in self._typed.items() if names}
+
+    def candidates(self, keyword: str, types=None) -> list:
+        """
+        Return every name id sharing a trigram with the keyword, most shared
+        first, optionally only names carried by a record of one of `types`.
+        """
+        allowed = None
+        if types is not None:
+            allowed = set().union(*(self._typed.get(t, ()) for t in types))
+            if not allowed:
+                return []
+
+        counts = defaultdict(int)
+        for gram in trigrams(keyword.lower()):
+            for name_id in self._postings.get(gram, ()):
+                counts[name_id] += 1
+        if allowed is not None:
+            counts = {i: n for i, n in counts.items() if i in allowed}
+        if not counts:
+            return []
+        return sorted(counts, key=counts.get, reverse=True)
+
+    def _first_owner(self, name_id: int, types=None) -> int:
+        """Oldest entry id carrying the name, of one of `types` if given."""
+        owners = self._owners[name_id]
+        if types is None:
+            return owners[0]
+        return next(i for i in owners if self._entries[i].type in types)
+
+    def find_in(self, text: str, types=None, cancel=None):
+        """
+        Return the record for the longest known name `text` asks about
+        (earliest on ties), or None; a name merely mentioned in a question
+        about something else doesn't count. With `types`, names without a
+        record of those types are skipped.
+        """
+        with self._lock:
+            if cancel is not None and cancel.is_set():
+                raise SearchCancelled()
+            best_id, best_words = None, 0
+            for name, words in self.scanner.subjects(text):
+                name_id = self._name_ids[name]
+                if types is not None and not any(name_id in self._typed.get(t, ()) for t in types):
+                    continue
+                if words > best_words:
+                    best_id, best_words = name_id, words
+            if best_id is None:
+                return None
+            return self._entries[self._first_owner(best_id, types)]
+
+    def search(self, keyword: str, types=None, cancel=None):
+        """
+        Return (record, score) for the best-scoring name, or (None, 0.0).
+        Scores are the difflib ratios a linear scan computes, over every name
+        that shares a three-character run with the keyword; ties keep the
+        entry that was indexed first. With `types`, only records of those
+        types are considered.
+        """
+        with self._lock:
+            return self._search(keyword, types, cancel)
+
+    def _search(self, keyword: str, types, cancel):
+        lowered = keyword.lower()
+        matcher = difflib.SequenceMatcher(None)
+        matcher.set_seq1(lowered)
+        # quick_ratio is symmetric, and with the keyword as seq2 its counts are built once
+        bound = difflib.SequenceMatcher(None)
+        bound.set_seq2(lowered)
+        length = len(lowered)
+        best_id = None
+        best_owner = None
+        best_score = 0.0
+
+        # Names are scored out of entry order, so a tie goes to the older owner
+        def beats(score, owner):
+            return score > best_score or (score == best_score and best_id is not None and owner < best_owner)
+
+        for n, name_id in enumerate(self.candidates(keyword, types)):
+            if cancel is not None and n % CANCEL_CHECK_EVERY == 0 and cancel.is_set():
+                raise SearchCancelled()
+            name = self._names[name_id]
+            owner = self._first_owner(name_id, types)
+            # Cheap upper bounds first (real_quick_ratio, then quick_ratio); they can only skip non-improving names
+            total = length + len(name)
+            if total and not beats(2.0 * min(length, len(name)) / total, owner):
+                continue
+            bound.set_seq1(name)
+            if not beats(bound.quick_ratio(), owner):
+                continue
+            matcher.set_seq2(name)
+            score = matcher.ratio()
+            if score > 0 and beats(score, owner):
+                best_score = score
+                best_id = name_id
+                best_owner = owner
+
+        if best_id is None:
+            return None, 0.0
+        return self._entries[best_owner], best_score
@@ -0,0 +1,67 @@
+"""
+Lightweight intent step for 5etools lookups.
+
+A question is mapped to content categories from the words it uses ("cast",
+"cantrip" → spells; "monk", "subclass" → classes; ...). Each category is
+a set of 5etools collection keys, which is what EntryRecord.type holds,
+so the name index can search just those entries first.
+"""
+
+import re
+
+# category -> (record types, trigger words)
+CATEGORIES = {
+    "spells": (
+        ("spell",),
+        {"spell", "spells", "cantrip", "cantrips", "cast", "casting", "ritual", "concentration", "incantation"},
+    ),
+    "bestiary": (
+        ("monster",),
+        {"monster", "monsters", "creature", "creatures", "beast", "beasts", "statblock", "cr", "legendary", "lair"},
+    ),
+    "items": (
+        ("item", "baseitem", "itemGroup", "magicvariant"),
+        {
+            "item", "items", "weapon", "weapons", "armor", "armour", "potion", "potions", "wand", "ring",
+            "staff", "rod", "scroll", "amulet", "cloak", "boots", "attune", "attunement", "gear",
+        },
+    ),
+    "classes": (
+        ("class", "subclass", "classFeature", "subclassFeature"),
+        {
+            "class", "classes", "subclass", "multiclass", "artificer", "barbarian", "bard", "cleric",
+            "druid", "fighter", "monk", "paladin", "ranger", "rogue", "sorcerer", "warlock", "wizard",
+        },
+    ),
+    "feats": (
+        ("feat",),
+        {"feat", "feats"},
+    ),
+    "races": (
+        ("race", "subrace"),
+        {"race", "races", "subrace", "species", "lineage", "ancestry"},
+    ),
+    "conditions": (
+        ("condition", "disease", "status"),
+        {
+            "condition", "conditions", "disease", "blinded", "charmed", "deafened", "exhaustion",
+            "frightened", "grappled", "incapacitated", "invisible", "paralyzed", "petrified",
+            "poisoned", "prone", "restrained", "stunned", "unconscious",
+        },
+    ),
+}
+
+_WORD = re.compile(r"[a-z]+")
+
+
+def classify(text: str) -> list:
+    """Categories the question points at, in CATEGORIES order; empty when unclear."""
+    words = set(_WORD.findall(text.lower()))
+    if "stat" in words and "block" in words:
+        words.add("statblock")
+    return [name for name, (_, triggers) in CATEGORIES.items() if words & triggers]
+
+
+def types_for(categories: list) -> set:
+    """Record types covered by a list of categories."""
+    return {t for name in categories for t in CATEGORIES[name][0]}
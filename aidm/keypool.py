@@ -0,0 +1,167 @@
+"""
+Health-aware scheduling for the OpenRouter key pool.
+
+Every key keeps running numbers: successes, failures, 429s, a smoothed
+latency, requests in flight and the last `limit_remaining` OpenRouter
+reported for it. A rate-limited key is put in cooldown (honouring
+Retry-After when given, doubling otherwise), a key rejected outright
+(401/402/403) sits out much longer, and the scheduler hands out the
+healthiest available key, spreading concurrent requests across keys.
+"""
+
+import time
+
+# Cooldowns, in seconds
+RATE_LIMIT_COOLDOWN = 5
+MAX_RATE_LIMIT_COOLDOWN = 120
+REJECTED_COOLDOWN = 600
+# Weight of the newest sample in the smoothed latency
+LATENCY_ALPHA = 0.3
+
+
+def mask_key(key: str) -> str:
+    return f"{key[:6]}...{key[-4:]}"
+
+
+class KeyHealth:
+    """Running stats for one API key."""
+
+    __slots__ = (
+        "requests", "successes", "failures", "rate_limited", "streak",
+        "latency", "in_flight", "cooldown_until", "limit_remaining", "last_used", "last_error",
+    )
+
+    def __init__(self):
+        self.requests = 0
+        self.successes = 0
+        self.failures = 0
+        self.rate_limited = 0
+        self.streak = 0             # consecutive 429s
+        self.latency = None         # smoothed seconds to response headers
+        self.in_flight = 0
+        self.cooldown_until = 0.0
+        self.limit_remaining = None
+        self.last_used = 0.0
+        self.last_error = None
+
+    def success_rate(self) -> float:
+        # Smoothed so a fresh key starts out looking healthy
+        return (self.successes + 1) / (self.requests + 2)
+
+    def score(self) -> float:
+        """Higher is better: success rate over latency, shared with requests in flight."""
+        latency = self.latency if self.latency is not None else 1.0
+        return self.success_rate() / (max(latency, 0.05) * (1 + self.in_flight))
+
+    def exhausted(self) -> bool:
+        return self.limit_remaining is not None and self.limit_remaining <= 0
+
+
+class KeyPool:
+    """Picks keys by health and records the outcome of every request."""
+
+    def __init__(self):
+        self._health = {}   # key -> KeyHealth
+
+    def health(self, key: str) -> KeyHealth:
+        return self._health.setdefault(key, KeyHealth())
+
+    def pick(self, keys: list, exclude=()):
+        """
+        Return (key, wait_seconds) for the best key not in `exclude`.
+        wait_seconds is 0 unless every candidate is cooling down, in which
+        case the key that frees up first is returned. Keys known to be out
+        of credit are only used when nothing else is left. (None, 0) when
+        there are no candidates at all.
+        """
+        candidates = [k for k in keys if k not in exclude]
+        if not candidates:
+            return None, 0.0
+
+        now = time.monotonic()
+        ready = [k for k in candidates if self.health(k).cooldown_until <= now]
+        if ready:
+            funded = [k for k in ready if not self.health(k).exhausted()] or ready
+            # Best score first; on ties the least recently used key, so load spreads evenly
+            key = max(funded, key=lambda k: (self.health(k).score(), -self.health(k).last_used))
+            return key, 0.0
+
+        key = min(candidates, key=lambda k: self.health(k).cooldown_until)
+        return key, self.health(key).cooldown_until - now
+
+    def started(self, key: str) -> float:
+        """
+        Mark a request as sent on `key`. Pass the result to `responded` once
+        the status is known, and call `released` when the request is over.
+        """
+        health = self.health(key)
+        health.requests += 1
+        health.in_flight += 1
+        health.last_used = time.monotonic()
+        return health.last_used
+
+    def released(self, key: str):
+        health = self.health(key)
+        health.in_flight = max(0, health.in_flight - 1)
+
+    def responded(self, key: str, started: float, status, retry_after=None, error: str = None):
+        """
+        Record how a request on `key` went. `status` is the HTTP status, or
+        None when the request failed before a response arrived.
+        """
+        health = self.health(key)
+        now = time.monotonic()
+
+        if status is not None and status < 400:
+            health.successes += 1
+            health.streak = 0
+            elapsed = now - started
+            if health.latency is None:
+                health.latency = elapsed
+            else:
+                health.latency += LATENCY_ALPHA * (elapsed - health.latency)
+            return
+
+        health.failures += 1
+        health.last_error = error or (f"HTTP {status}" if status else "no response")
+        if status == 429:
+            health.rate_limited += 1
+            health.streak += 1
+            cooldown = retry_after or min(MAX_RATE_LIMIT_COOLDOWN, RATE_LIMIT_COOLDOWN * 2 ** (health.streak - 1))
+            health.cooldown_until = now + cooldown
+        elif status in (401, 402, 403):
+            health.cooldown_until = now + REJECTED_COOLDOWN
+
+    def set_limit_remaining(self, key: str, remaining):
+        """Store the credit OpenRouter reports for a key (None for unlimited)."""
+        self.health(key).limit_remaining = remaining
+
+    def summary(self, keys: list) -> list:
+        """One line per key: state, success rate, 429s, latency, load and credit left."""
+        now = time.monotonic()
+        lines = []
+        for i, key in enumerate(keys, 1):
+            health = self.health(key)
+            latency = f"{health.latency:.2f}s" if health.latency is not None else "-"
+            if health.cooldown_until > now:
+                state = f"cooldown {health.cooldown_until - now:.0f}s"
+            elif health.exhausted():
+                state = "out of credit"
+            else:
+                state = "ready"
+            lines.append(
+                f"Key {i} {mask_key(key)}: {state}, {health.successes}/{health.requests} ok, "
+                f"{health.rate_limited}x429, latency {latency}, in flight {health.in_flight}, "
+                f"limit_remaining {health.limit_remaining if health.limit_remaining is not None else '-'}"
+            )
+            if health.last_error:
+                lines.append(f"  last error: {health.last_error}")
+        return lines
+
+
+def parse_retry_after(value):
+    """Seconds from a Retry-After header, or None."""
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,167 @@
+"""
+Local 5etools bundles.
+
+`fivetools_url` may point at a local copy instead of a web server:
+
+    file:///srv/5etools/data          a data/ directory
+    file:///srv/5etools-v1.210.zip    a release or data zip
+
+Endpoints are the same relative paths used over HTTP ("spells/spells-phb.json").
+Directory files are memory-mapped and decoded straight from the mapping;
+a zip is memory-mapped once and its members are read through it. Inside a
+zip the data root is found automatically, so a release zip that holds
+"5etools-v1.210/data/..." works as-is. Everything here blocks, so callers
+run it in a worker thread.
+
+version() gives a cheap change validator per file (mtime and size, or the
+member's CRC inside a zip); a zip replaced on disk is reopened on the next
+access, while readers still holding the old archive finish with it.
+"""
+
+import json
+import mmap
+import threading
+import zipfile
+from collections import Counter
+from pathlib import Path
+from urllib.parse import unquote, urlparse
+
+from .records import project
+
+
+def local_path(url: str):
+    """Filesystem path for a file:// URL, or None for anything else."""
+    if not url.startswith("file://"):
+        return None
+    return Path(unquote(urlparse(url).path))
+
+
+class _MappedFile:
+    """The file interface ZipFile needs, over an mmap (which lacks seekable() before 3.13)."""
+
+    def __init__(self, mapped: mmap.mmap):
+        self._map = mapped
+        self.read = mapped.read
+        self.seek = mapped.seek
+        self.tell = mapped.tell
+
+    def seekable(self) -> bool:
+        return True
+
+    def close(self):
+        self._map.close()
+
+
+class LocalBundle:
+    """Read-only access to a 5etools data directory or zip."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.is_zip = path.is_file() and zipfile.is_zipfile(path)
+        self._zip = None
+        self._map = None
+        self._stamp = None      # (mtime_ns, size) of the zip when it was mapped
+        self._root = ""
+        self._lock = threading.Lock()
+        if not self.is_zip and not path.is_dir():
+            raise FileNotFoundError(f"No 5etools data directory or zip at {path}")
+
+    def _archive(self) -> zipfile.ZipFile:
+        with self._lock:
+            stat = self.path.stat()
+            if self._zip is not None and self._stamp != (stat.st_mtime_ns, stat.st_size):
+                # Replaced on disk: map the new file; the old mapping closes once unreferenced
+                self._zip = self._map = None
+            if self._zip is None:
+                self._stamp = (stat.st_mtime_ns, stat.st_size)
+                with open(self.path, "rb") as fh:
+                    self._map = _MappedFile(mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ))
+                self._zip = zipfile.ZipFile(self._map)
+                self._root = self._find_root(self._zip.namelist())
+            return self._zip
+
+    @staticmethod
+    def _find_root(names: list) -> str:
+        """
+        The prefix most JSON files under "spells/", "bestiary/" or "class/"
+        share (release zips also carry img/bestiary/... and the like).
+        """
+        roots = Counter()
+        for name in names:
+            if not name.endswith(".json"):
+                continue
+            for anchor in ("spells/", "bestiary/", "class/"):
+                at = name.find(anchor)
+                if at == 0 or (at > 0 and name[at - 1] == "/"):
+                    roots[name[:at]] += 1
+        return max(roots, key=lambda root: (roots[root], -len(root))) if roots else ""
+
+    def read_text(self, endpoint: str):
+        """The file's text, or None if the bundle doesn't have it."""
+        if self.is_zip:
+            archive = self._archive()
+            try:
+                return archive.read(self._root + endpoint).decode("utf-8")
+            except KeyError:
+                return None
+
+        file = self.path / endpoint
+        try:
+            with open(file, "rb") as fh:
+                if file.stat().st_size == 0:
+                    return ""
+                with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    # Decode from the mapped pages without an intermediate bytes copy
+                    with memoryview(mapped) as view:
+                        return str(view, "utf-8")
+        except FileNotFoundError:
+            return None
+
+    def version(self, endpoint: str):
+        """A value that changes whenever the file does, or None if it isn't in the bundle."""
+        if self.is_zip:
+            try:
+                info = self._archive().getinfo(self._root + endpoint)
+            except KeyError:
+                return None
+            return info.CRC, info.file_size
+        try:
+            stat = (self.path / endpoint).stat()
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def load_records(self, endpoint: str):
+        """Read, decode and project one file; None if it isn't in the bundle."""
+        text = self.read_text(endpoint)
+        if text is None:
+            return None
+        return project(json.loads(text))
+
+    def list_dir(self, directory: str) -> list:
+        """File names directly inside a bundle directory ("class")."""
+        directory = directory.strip("/")
+        if self.is_zip:
+            archive = self._archive()
+            prefix = f"{self._root}{directory}/"
+            names = []
+            for name in archive.namelist():
+                if name.startswith(prefix):
+                    rest = name[len(prefix):]
+                    if rest and "/" not in rest:
+                        names.append(rest)
+            return sorted(names)
+
+        folder = self.path / directory
+        if not folder.is_dir():
+            return []
+        return sorted(p.name for p in folder.iterdir() if p.is_file())
+
+    def close(self):
+        with self._lock:
+            if self._zip is not None:
+                self._zip.close()
+                self._zip = None
+            if self._map is not None:
+                self._map.close()
+                self._map = None
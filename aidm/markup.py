@@ -0,0 +1,129 @@
+"""
+Single-pass renderer for 5etools markup.
+
+Flat markup (almost every string) is split once on "{@" and each tag is
+cut down to its display text with plain string operations. Strings with
+nested tags, class feature pipes or `<$formula$>` placeholders go through
+a tokenizer that walks the string once, keeping a stack of open tags so
+markup such as `{@note cast {@spell fireball|phb} at will}` comes out right.
+"""
+
+import re
+
+FORMULAS = {
+    "level": "level",
+    "int_mod": "INT modifier",
+    "wis_mod": "WIS modifier",
+    "cha_mod": "CHA modifier",
+    "str_mod": "STR modifier",
+    "dex_mod": "DEX modifier",
+    "con_mod": "CON modifier",
+}
+
+_TOKEN = re.compile(
+    r"(?P<open>\{@[a-zA-Z]+ ?)"
+    r"|(?P<close>\})"
+    r"|(?P<feature>\|[A-Za-z]+\|\|(?P<level>\d+))"
+    r"|(?P<pipe>\|[a-zA-Z0-9]*)"
+    r"|(?P<formula><\$(?P<var>.*?)\$>)"
+)
+
+_MECHANICS = re.compile(
+    r"\b(?P<kind>CR|DC)\s?(?P<value>\d+)\b"           # CR or DC followed by optional space and digits
+    r"|(?P<dice>\d+d\d+)\s*[:=]\s*(?P<total>\d+)"     # Rolls like: "Roll 1d20 = 14" or "1d20: 14"
+    r"|\b[Rr]oll(?:ed)?[: ]+(?P<roll>\d+)\b"          # Standalone roll results like "Roll: 14" or "roll 17"
+)
+
+
+def render_markup(text: str, formulas: bool = False, features: bool = False) -> str:
+    """
+    Strip 5etools markup in one pass, keeping each tag's display text.
+
+    `{@tag text|source|...}` becomes `text` (nested tags included),
+    leftover `|source` suffixes are dropped, and tags without text vanish.
+    With `features`, class feature pipes like `Flurry|Monk||2` become
+    `Flurry (Level 2)`; with `formulas`, `<$int_mod$>` becomes `INT modifier`.
+    """
+    if "{@" not in text and "|" not in text and "<$" not in text:
+        return text.strip()
+    if "{@" not in text or (formulas and "<$" in text) or (features and "||" in text):
+        return _render_tokens(text, formulas, features)
+
+    head, *segments = text.split("{@")
+    if "|" in head or "<$" in head:
+        return _render_tokens(text, formulas, features)
+
+    out = [head]
+    for segment in segments:
+        close = segment.find("}")
+        rest = segment[close + 1:]
+        # No closing brace before the next tag means nesting (or broken markup)
+        if close < 0 or "|" in rest or "<$" in rest:
+            return _render_tokens(text, formulas, features)
+        name, _, content = segment[:close].partition(" ")
+        if not name.isalpha():
+            return _render_tokens(text, formulas, features)
+        out.append(content.partition("|")[0])
+        out.append(rest)
+    return "".join(out).strip()
+
+
+def _render_tokens(text: str, formulas: bool, features: bool) -> str:
+    """Tokenizer path of render_markup: nested tags, feature pipes and formulas."""
+    # Each frame: [parts, skipping]. Frame 0 is the top level.
+    stack = [[[], False]]
+    pos = 0
+
+    for match in _TOKEN.finditer(text):
+        frame = stack[-1]
+        if match.start() > pos and not frame[1]:
+            frame[0].append(text[pos:match.start()])
+        pos = match.end()
+        kind = match.lastgroup
+
+        if kind == "open":
+            stack.append([[], frame[1]])
+        elif kind == "close":
+            if len(stack) == 1:
+                frame[0].append("}")
+                continue
+            stack.pop()
+            if not stack[-1][1]:
+                stack[-1][0].append("".join(frame[0]))
+        elif kind == "feature" and features and len(stack) == 1:
+            frame[0].append(f" (Level {match.group('level')})")
+        elif kind in ("feature", "pipe"):
+            if len(stack) > 1:
+                # Everything after the first pipe of a tag is source/display metadata
+                frame[1] = True
+            elif match.group() == "|":
+                frame[0].append("|")
+            elif kind == "feature":
+                # "|Class||3" without feature mode: drop "|Class", keep "|", drop "|3"
+                frame[0].append("|")
+        elif not frame[1]:
+            var = match.group("var")
+            frame[0].append(FORMULAS.get(var, var) if formulas else match.group())
+
+    if pos < len(text) and not stack[-1][1]:
+        stack[-1][0].append(text[pos:])
+
+    # Unclosed tags: keep their text rather than lose it
+    while len(stack) > 1:
+        parts, _ = stack.pop()
+        stack[-1][0].append("".join(parts))
+
+    return "".join(stack[0][0]).strip()
+
+
+def _hide(match) -> str:
+    if match.group("kind"):
+        return f"||{match.group('kind')}{match.group('value')}||"
+    if match.group("dice"):
+        return f"||{match.group('dice')} = {match.group('total')}||"
+    return f"||Roll {match.group('roll')}||"
+
+
+def hide_mechanics(text: str) -> str:
+    """Wrap DCs, CRs and roll results in Discord spoilers, in one pass."""
+    return _MECHANICS.sub(_hide, text)
@@ -0,0 +1,87 @@
+"""
+Token-budgeted prompt assembly.
+
+Token counts are estimated (about four characters per token plus a small
+per-message overhead), which is close enough for budgeting without
+shipping a tokenizer for every OpenRouter model.
+"""
+
+from collections import namedtuple
+
+MESSAGE_OVERHEAD = 4
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def message_tokens(message: dict) -> int:
+    return estimate_tokens(message.get("content") or "") + MESSAGE_OVERHEAD
+
+
+def is_summary(message: dict) -> bool:
+    return message.get("role") == "system"
+
+
+def is_rules_turn(message: dict) -> bool:
+    """A stored rules Q&A message, as opposed to part of the adventure."""
+    return bool(message.get("rules"))
+
+
+def has_story(context: list) -> bool:
+    """Whether the context holds adventure turns (or a summary of them), not just rules Q&A."""
+    return any(is_summary(m) or not is_rules_turn(m) for m in context)
+
+
+def _wire(message: dict) -> dict:
+    """A stored message as sent to the API, without bookkeeping keys."""
+    return {"role": message["role"], "content": message["content"]}
+
+
+PromptWindow = namedtuple("PromptWindow", "messages tokens kept available trimmed_tokens")
+
+
+def fit_context(system: list, context: list, question: dict, budget: int) -> PromptWindow:
+    """
+    Build the message list: system prompt, every session summary, then as
+    many of the newest turns as fit in `budget`, then the question.
+    """
+    summaries = [m for m in context if is_summary(m)]
+    turns = [m for m in context if not is_summary(m)]
+
+    used = sum(message_tokens(m) for m in system + summaries) + message_tokens(question)
+    kept = []
+    for message in reversed(turns):
+        cost = message_tokens(message)
+        if used + cost > budget:
+            break
+        kept.append(message)
+        used += cost
+    kept.reverse()
+
+    trimmed = sum(message_tokens(m) for m in turns[:len(turns) - len(kept)])
+    messages = system + [_wire(m) for m in summaries + kept] + [question]
+    return PromptWindow(messages, used, len(kept), len(turns), trimmed)
+
+
+class PromptStats:
+    """Running totals of estimated prompt tokens sent and trimmed."""
+
+    def __init__(self):
+        self.requests = 0
+        self.tokens_sent = 0
+        self.tokens_trimmed = 0
+
+    def record(self, sent: int, trimmed: int):
+        self.requests += 1
+        self.tokens_sent += sent
+        self.tokens_trimmed += trimmed
+
+    def summary(self) -> list:
+        avg = self.tokens_sent / self.requests if self.requests else 0
+        return [
+            f"Prompts built: {self.requests}",
+            f"Tokens sent (est.): {self.tokens_sent} (avg {avg:.0f})",
+            f"Tokens trimmed (est.): {self.tokens_trimmed}",
+        ]
@@ -0,0 +1,131 @@
+"""
+Compact records for loaded 5etools entries.
+
+A decoded 5etools file is a deep tree of dicts and lists, and most of it
+(stat blocks, nested entries, fluff flags) is only needed when one entry
+is actually shown. At load time every named entry is projected into an
+EntryRecord that keeps what search needs (name, lowercased key, type and
+source) plus the body as zlib-compressed JSON, decoded only on display.
+The decoded tree is dropped as soon as the file is projected.
+
+Entries that are `_copy` stubs keep the parent they copy in `copy_of`
+until NameIndex.resolve_copies swaps in the merged body. When the same
+entry is loaded from several sources, source_rank orders them so the
+preferred printing is the one lookups return.
+"""
+
+import json
+import sys
+import zlib
+
+# Never displayed, so not worth keeping in the body
+DROP_KEYS = frozenset({"hasFluff", "hasFluffImages", "fluff", "fluffImages", "otherSources"})
+
+# Preferred sources first when an entry exists in several books: the core
+# rulebooks, then the revised reprints ahead of the books they replace
+SOURCE_PRIORITY = (
+    "PHB", "MM", "DMG", "XGE", "TCE", "MPMM", "VGM", "MTF", "FTD", "BGG", "BMT", "SCC",
+    "EGW", "GGR", "MOT", "VRGR", "SCAG", "AI", "ERLW", "XPHB", "XMM", "XDMG",
+)
+_SOURCE_RANK = {source: i for i, source in enumerate(SOURCE_PRIORITY)}
+
+
+class EntryRecord:
+    """One named 5etools entry: search fields plus a lazily decoded body."""
+
+    __slots__ = ("name", "key", "type", "source", "reprinted", "copy_of", "_body")
+
+    def __init__(self, name: str, type: str, source: str, body: bytes, reprinted=False, copy_of=None):
+        self.name = name
+        self.key = name.lower()
+        self.type = type        # the file's collection key: "spell", "monster", "item", ...
+        self.source = source    # book abbreviation, e.g. "PHB"
+        self.reprinted = reprinted  # superseded by a reprint in another book
+        self.copy_of = copy_of  # (type, lowered name, source) of the parent of an unresolved _copy
+        self._body = body
+
+    def __repr__(self):
+        return f"<EntryRecord {self.type} {self.name!r} ({self.source})>"
+
+    @property
+    def entry(self) -> dict:
+        """The entry as a fresh dict, decoded from the compressed body."""
+        return json.loads(zlib.decompress(self._body))
+
+    def set_entry(self, entry: dict):
+        """Replace the body with a resolved entry."""
+        self._body = encode(entry)
+        self.copy_of = None
+
+    def nbytes(self) -> int:
+        """Memory held by this record alone (type and source strings are shared)."""
+        return sys.getsizeof(self) + sys.getsizeof(self.name) + sys.getsizeof(self.key) + sys.getsizeof(self._body)
+
+
+def encode(entry: dict) -> bytes:
+    """Compressed JSON body for an entry, without the keys that are never shown."""
+    body = {k: v for k, v in entry.items() if k not in DROP_KEYS}
+    return zlib.compress(json.dumps(body, separators=(",", ":"), ensure_ascii=False).encode("utf-8"))
+
+
+def source_rank(record) -> tuple:
+    """Sort key among records of the same name: complete, current and preferred sources first."""
+    return (record.copy_of is not None, record.reprinted, _SOURCE_RANK.get(record.source, len(_SOURCE_RANK)))
+
+
+def _copy_target(kind: str, entry: dict):
+    meta = entry.get("_copy")
+    if not isinstance(meta, dict) or not isinstance(meta.get("name"), str):
+        return None
+    source = meta.get("source")
+    return kind, meta["name"].lower(), source if isinstance(source, str) else ""
+
+
+def project(data) -> list:
+    """Named entries of a decoded 5etools file as records, in file order."""
+    if not isinstance(data, dict):
+        return []
+
+    records = []
+    for kind, value in data.items():
+        if not (isinstance(value, list) and value and isinstance(value[0], dict)):
+            continue
+        kind = sys.intern(kind)
+        for entry in value:
+            name = entry.get("name") if isinstance(entry, dict) else None
+            if not name or not isinstance(name, str):
+                continue
+            source = entry.get("source")
+            records.append(EntryRecord(
+                name,
+                kind,
+                sys.intern(source) if isinstance(source, str) else "",
+                encode(entry),
+                reprinted=bool(entry.get("reprintedAs") or entry.get("isReprinted")),
+                copy_of=_copy_target(kind, entry),
+            ))
+    return records
+
+
+def load_records(raw: bytes) -> list:
+    """Decode a raw 5etools file and project it; meant to run in a worker thread."""
+    return project(json.loads(raw))
+
+
+def deep_sizeof(obj) -> int:
+    """Approximate memory of a decoded JSON tree, counting shared objects once."""
+    seen = set()
+    total = 0
+    stack = [obj]
+    while stack:
+        item = stack.pop()
+        if id(item) in seen:
+            continue
+        seen.add(id(item))
+        total += sys.getsizeof(item)
+        if isinstance(item, dict):
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, list):
+            stack.extend(item)
+    return total
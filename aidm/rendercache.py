@@ -0,0 +1,93 @@
+"""
+LRU cache of rendered 5etools entries.
+
+Keys are the source file plus the identity of the entry record, so a file
+refresh (which replaces every record) can drop all of that file's renders
+at once. Size is bounded by the total length of cached text.
+"""
+
+import sys
+from collections import OrderedDict
+
+
+class RenderCache:
+    """Rendered entry text, evicted least-recently-used past `max_bytes`."""
+
+    def __init__(self, max_bytes: int = 4 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._items = OrderedDict()     # (endpoint, id(entry)) -> (entry, text, size)
+        self._by_file = {}              # endpoint -> set of keys
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, endpoint: str, entry):
+        key = (endpoint, id(entry))
+        item = self._items.get(key)
+        # The entry is held by the cache, so a matching id means the same object
+        if item is None or item[0] is not entry:
+            self.misses += 1
+            return None
+        self._items.move_to_end(key)
+        self.hits += 1
+        return item[1]
+
+    def put(self, endpoint: str, entry, text: str):
+        key = (endpoint, id(entry))
+        self._discard(key)
+        size = sys.getsizeof(text)
+        if size > self.max_bytes:
+            return
+        self._items[key] = (entry, text, size)
+        self._by_file.setdefault(endpoint, set()).add(key)
+        self.bytes += size
+        self._evict()
+
+    def resize(self, max_bytes: int):
+        """Change the memory budget, evicting down to it right away."""
+        self.max_bytes = max_bytes
+        self._evict()
+
+    def _evict(self):
+        while self.bytes > self.max_bytes and self._items:
+            self._discard(next(iter(self._items)))
+            self.evictions += 1
+
+    def _discard(self, key):
+        item = self._items.pop(key, None)
+        if item is None:
+            return
+        self.bytes -= item[2]
+        keys = self._by_file.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_file[key[0]]
+
+    def invalidate_file(self, endpoint: str):
+        """Drop every render that came from one file."""
+        for key in list(self._by_file.get(endpoint, ())):
+            self._discard(key)
+
+    def clear(self):
+        """Drop every render."""
+        self._items.clear()
+        self._by_file.clear()
+        self.bytes = 0
+
+    def summary(self) -> list:
+        """Size, hits and misses, hit rate and evictions."""
+        lookups = self.hits + self.misses
+        rate = self.hits / lookups * 100 if lookups else 0.0
+        return [
+            f"Entries: {len(self)}",
+            f"Memory: {self.bytes / 1024:.0f} KB / {self.max_bytes / 1024:.0f} KB",
+            f"Hits: {self.hits}",
+            f"Misses: {self.misses}",
+            f"Hit rate: {rate:.0f}%",
+            f"Evictions: {self.evictions}",
+        ]
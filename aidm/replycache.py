@@ -0,0 +1,87 @@
+"""
+TTL + LRU cache of DM replies to context-free rules questions.
+
+Keys are the model plus the normalized question, so "How does grapple
+work?" and "how does grapple work" share an entry. The cache is saved to
+a JSON file so answers survive reloads.
+"""
+
+import json
+import re
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+
+def normalize_question(text: str) -> str:
+    """Lowercase, drop punctuation and collapse whitespace."""
+    text = re.sub(r"[^\w\s]", " ", text.lower())
+    return " ".join(text.split())
+
+
+class ReplyCache:
+    """Bounded reply cache with per-entry expiry and hit/miss counters."""
+
+    def __init__(self, path: Path, ttl: int = 86400, max_entries: int = 500):
+        self.path = Path(path)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()   # key -> (expires_at, reply)
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def key(model: str, question: str) -> str:
+        return f"{model}\n{normalize_question(question)}"
+
+    def get(self, model: str, question: str):
+        """Return a fresh cached reply or None, counting the hit or miss."""
+        key = self.key(model, question)
+        item = self._entries.get(key)
+        if item is None or item[0] < time.time():
+            if item is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return item[1]
+
+    def put(self, model: str, question: str, reply: str):
+        key = self.key(model, question)
+        self._entries[key] = (time.time() + self.ttl, reply)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def load(self):
+        """Read the cache file, skipping anything already expired."""
+        try:
+            rows = json.loads(self.path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return
+        now = time.time()
+        for key, expires_at, reply in rows:
+            if expires_at > now:
+                self._entries[key] = (expires_at, reply)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def snapshot(self) -> list:
+        """Rows to hand to `save`, taken on the event loop."""
+        return [[key, expires_at, reply] for key, (expires_at, reply) in self._entries.items()]
+
+    def save(self, rows: list):
+        """Write rows from `snapshot`; safe to run in a worker thread, one call at a time."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        tmp.write_text(json.dumps(rows), encoding="utf-8")
+        tmp.replace(self.path)
@@ -0,0 +1,124 @@
+"""
+Exact entity scanner for questions.
+
+Every indexed 5etools name is normalized to lowercase words ("Tasha's
+Hideous Laughter" → "tashas hideous laughter") and kept in a phrase table.
+A question is normalized the same way and scanned left to right once: at
+each word the longest known phrase starting there wins, so "potion of
+greater healing" beats "potion of healing" and "healing". A trailing
+plural "s" is tried as well ("goblins" → "goblin").
+
+A name found in a question only counts as what the question is about when
+the question is lookup-shaped around it ("what is a goblin", "how does
+fireball work in combat") or the name is most of what the question says.
+"can I sneak past the goblin while it sleeps?" names a goblin, but it is
+a question for the DM, not for the rules.
+"""
+
+import re
+
+_WORD = re.compile(r"[a-z0-9]+")
+_APOSTROPHES = str.maketrans("", "", "'’")
+
+# Names that are also everyday words would match almost any question
+STOP_PHRASES = frozenset({
+    "a", "an", "the", "and", "or", "but", "if", "to", "from", "in", "on", "at", "by", "for", "of",
+    "is", "are", "it", "me", "my", "you", "what", "who", "how", "can", "do", "does", "tell", "about",
+})
+
+# Openings of a question asking what something is, as normalized words
+LOOKUP_LEADS = frozenset({
+    ("what", "is"), ("what", "are"), ("whats",), ("what", "does"), ("what", "do"), ("who", "is"),
+    ("how", "does"), ("how", "do"), ("tell", "me", "about"), ("describe",), ("explain",),
+    ("can", "you", "explain"), ("can", "you", "describe"), ("can", "you", "tell", "me", "about"),
+})
+ARTICLES = frozenset({"a", "an", "the"})
+# Words that may follow the name in a lookup-shaped question
+LOOKUP_TAILS = frozenset({
+    "do", "does", "work", "works", "mean", "means", "in", "combat", "to", "me", "us", "exactly", "again", "please",
+    "stats", "stat", "block", "statblock", "spell", "rules",
+})
+# Words ignored when measuring how much of a question a name covers
+FILLER = STOP_PHRASES | {"i", "we", "please", "explain", "describe"} | LOOKUP_TAILS
+# Share of a question's other words a name must make up to count without a lookup lead
+MIN_COVERAGE = 0.6
+
+
+def normalize(text: str) -> str:
+    """Lowercase words joined by single spaces, apostrophes and other punctuation dropped."""
+    return " ".join(_WORD.findall(text.lower().translate(_APOSTROPHES)))
+
+
+def is_subject(words: list, start: int, length: int) -> bool:
+    """Whether the name at words[start:start + length] is what the question asks about."""
+    lead = words[:start]
+    while lead and lead[-1] in ARTICLES:
+        lead.pop()
+    if tuple(lead) in LOOKUP_LEADS and all(w in LOOKUP_TAILS for w in words[start + length:]):
+        return True
+    name = [w for w in words[start:start + length] if w not in FILLER]
+    content = [w for w in words if w not in FILLER]
+    return bool(content) and len(name) >= MIN_COVERAGE * len(content)
+
+
+class EntityScanner:
+    """Phrase table of entity names with a leftmost-longest scan."""
+
+    def __init__(self):
+        self._phrases = {}      # normalized phrase -> lowered names, first added first
+        self._max_words = 0
+
+    def __len__(self):
+        return len(self._phrases)
+
+    def add(self, name: str):
+        phrase = normalize(name)
+        if len(phrase) < 3 or phrase.isdigit() or phrase in STOP_PHRASES:
+            return
+        self._phrases.setdefault(phrase, []).append(name)
+        self._max_words = max(self._max_words, phrase.count(" ") + 1)
+
+    def remove(self, name: str):
+        phrase = normalize(name)
+        names = self._phrases.get(phrase)
+        if names and name in names:
+            names.remove(name)
+            if not names:
+                del self._phrases[phrase]
+
+    def clear(self):
+        self._phrases.clear()
+        self._max_words = 0
+
+    def _lookup(self, phrase: str):
+        names = self._phrases.get(phrase)
+        if names is None and len(phrase) > 3 and phrase.endswith("s"):
+            names = self._phrases.get(phrase[:-1])
+        return names
+
+    def _spans(self, words: list) -> list:
+        """(lowered name, start, words matched), leftmost-longest and non-overlapping."""
+        found = []
+        i = 0
+        while i < len(words):
+            for n in range(min(self._max_words, len(words) - i), 0, -1):
+                names = self._lookup(" ".join(words[i:i + n]))
+                if names:
+                    found.extend((name, i, n) for name in names)
+                    i += n
+                    break
+            else:
+                i += 1
+        return found
+
+    def scan(self, text: str) -> list:
+        """
+        Known names in `text` as (lowered name, words matched), leftmost-longest
+        and non-overlapping, in the order they appear.
+        """
+        return [(name, n) for name, _, n in self._spans(normalize(text).split())]
+
+    def subjects(self, text: str) -> list:
+        """Like scan, but only names the question is about (see is_subject)."""
+        words = normalize(text).split()
+        return [(name, n) for name, start, n in self._spans(words) if is_subject(words, start, n)]
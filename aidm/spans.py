@@ -0,0 +1,115 @@
+"""
+Per-stage latency spans.
+
+`tracer.span("search_5etools")` times a block. Each finished span goes
+into a per-stage window of recent durations (for p50/p90/p99), is logged
+to `red.aidm` at DEBUG as one logfmt line, and is added to the current
+turn, if any. `tracer.turn(...)` wraps one handled message; when it ends
+a single INFO line lists the turn's total and its time per stage:
+
+    span stage=search_5etools ms=3.1 keyword=fireball
+    turn channel=123 total_ms=2210.4 entity_scan=0.1 query_ai=2150.2 discord_send=51.0
+
+The current turn lives in a context variable, so spans inside awaited
+helpers and tasks started during the turn land in the right place.
+"""
+
+import contextlib
+import contextvars
+import logging
+import math
+import time
+from collections import deque
+
+log = logging.getLogger("red.aidm")
+
+_current_turn = contextvars.ContextVar("aidm_turn", default=None)
+
+
+def logfmt(**fields) -> str:
+    """key=value pairs, quoting values that contain spaces, quotes or '='."""
+    parts = []
+    for key, value in fields.items():
+        if isinstance(value, float):
+            value = f"{value:.1f}"
+        value = str(value)
+        if not value or any(c in value for c in ' "='):
+            value = '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+        parts.append(f"{key}={value}")
+    return " ".join(parts)
+
+
+def percentile(ordered: list, pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not ordered:
+        return 0.0
+    rank = max(0, min(len(ordered) - 1, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+def detach_turn():
+    """Stop the calling task's spans from counting toward the turn that started it."""
+    _current_turn.set(None)
+
+
+class Tracer:
+    """Recent span durations per stage, plus per-turn breakdowns."""
+
+    def __init__(self, window: int = 1000):
+        self.window = window
+        self._samples = {}      # stage -> deque of milliseconds
+        self._counts = {}       # stage -> spans since load
+
+    def record(self, stage: str, ms: float, **fields):
+        samples = self._samples.get(stage)
+        if samples is None:
+            samples = self._samples[stage] = deque(maxlen=self.window)
+        samples.append(ms)
+        self._counts[stage] = self._counts.get(stage, 0) + 1
+
+        turn = _current_turn.get()
+        if turn is not None:
+            turn[stage] = turn.get(stage, 0.0) + ms
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("span %s", logfmt(stage=stage, ms=ms, **fields))
+
+    @contextlib.contextmanager
+    def span(self, stage: str, **fields):
+        """Time the enclosed block as one `stage` span."""
+        start = time.perf_counter()
+        try:
+            yield fields
+        finally:
+            self.record(stage, (time.perf_counter() - start) * 1000, **fields)
+
+    @contextlib.contextmanager
+    def turn(self, **fields):
+        """Collect the spans of one handled message and log the breakdown at the end."""
+        stages = {}
+        token = _current_turn.set(stages)
+        start = time.perf_counter()
+        try:
+            yield stages
+        finally:
+            _current_turn.reset(token)
+            total = (time.perf_counter() - start) * 1000
+            self.record("turn", total)
+            log.info("turn %s", logfmt(**fields, total_ms=total, **stages))
+
+    def reset(self):
+        self._samples.clear()
+        self._counts.clear()
+
+    def summary(self) -> list:
+        """One line per stage: count and p50/p90/p99/max over the recent window."""
+        if not self._samples:
+            return ["No spans recorded yet."]
+        lines = [f"{'stage':<18} {'count':>6} {'p50':>9} {'p90':>9} {'p99':>9} {'max':>9}  (ms)"]
+        for stage in sorted(self._samples, key=lambda s: (s == "turn", s)):
+            ordered = sorted(self._samples[stage])
+            lines.append(
+                f"{stage:<18} {self._counts[stage]:>6} "
+                f"{percentile(ordered, 50):>9.1f} {percentile(ordered, 90):>9.1f} "
+                f"{percentile(ordered, 99):>9.1f} {ordered[-1]:>9.1f}"
+            )
+        return lines
@@ -0,0 +1,122 @@
+"""
+Streaming DM replies.
+
+OpenRouter's chat completions endpoint streams server-sent events when
+called with `"stream": true`. `iter_sse_deltas` turns that stream into text
+deltas, and `MessageStreamer` shows them in Discord by editing a placeholder
+message at a bounded rate, rolling over into a new message at the limit.
+"""
+
+import json
+import time
+
+DISCORD_LIMIT = 2000
+
+
+async def iter_sse_deltas(resp):
+    """Yield content deltas from an OpenAI-style SSE response body."""
+    buffer = b""
+    async for chunk in resp.content.iter_any():
+        buffer += chunk
+        while b"\n" in buffer:
+            line, buffer = buffer.split(b"\n", 1)
+            line = line.strip()
+            # Blank separators and ": OPENROUTER PROCESSING" keep-alive comments
+            if not line or line.startswith(b":") or not line.startswith(b"data:"):
+                continue
+            payload = line[5:].strip()
+            if payload == b"[DONE]":
+                return
+            try:
+                data = json.loads(payload)
+            except ValueError:
+                continue
+            if isinstance(data, dict) and data.get("error"):
+                err = data["error"]
+                if isinstance(err, dict):
+                    err = err.get("message") or str(err)
+                raise RuntimeError(f"OpenRouter stream error: {err}")
+            choices = data.get("choices") or []
+            if not choices:
+                continue
+            delta = choices[0].get("delta") or {}
+            text = delta.get("content") or choices[0].get("text")
+            if text:
+                yield text
+
+
+class MessageStreamer:
+    """
+    Progressively edit Discord messages as reply text arrives.
+
+    `render` turns raw text into what is displayed (e.g. hide_mechanics); the
+    first message carries `prefix`. Edits happen at most once per
+    `min_interval` seconds, and text past the 2000-character limit rolls over
+    into a new message, split on a line or word boundary.
+    """
+
+    def __init__(self, channel, render=None, prefix: str = "", min_interval: float = 1.2,
+                 placeholder: str = "*The DM is thinking...*"):
+        self.channel = channel
+        self.render = render or (lambda text: text)
+        self.prefix = prefix
+        self.min_interval = min_interval
+        self.placeholder = placeholder
+        self.messages = []      # sent discord.Message objects
+        self.sealed = []        # raw text of messages that are full
+        self.current = ""       # raw text of the message being edited
+        self._shown = None      # last content sent for the current message
+        self._last_edit = 0.0
+
+    @property
+    def text(self) -> str:
+        """All raw text received so far."""
+        return "".join(self.sealed) + self.current
+
+    def _content(self, raw: str) -> str:
+        head = self.prefix if not self.sealed else ""
+        return head + self.render(raw)
+
+    def _split_point(self, raw: str) -> int:
+        """Largest boundary in raw whose rendered message still fits the limit."""
+        cut = len(raw)
+        while cut > 0 and len(self._content(raw[:cut])) > DISCORD_LIMIT:
+            window = raw[:cut - 1]
+            boundary = max(window.rfind("\n"), window.rfind(" "))
+            cut = boundary + 1 if boundary > 0 else cut - 1
+        return cut or 1
+
+    async def start(self):
+        """Post the placeholder message."""
+        self.messages.append(await self.channel.send(self.prefix + self.placeholder))
+        self._last_edit = time.monotonic()
+
+    async def feed(self, delta: str):
+        """Add text; edit or roll over if enough time or text has accumulated."""
+        self.current += delta
+        while len(self._content(self.current)) > DISCORD_LIMIT:
+            cut = self._split_point(self.current)
+            full, self.current = self.current[:cut], self.current[cut:]
+            await self._show(full, force=True)
+            self.sealed.append(full)
+            self.messages.append(await self.channel.send(self._content(self.current) or "…"))
+            self._shown = self._content(self.current) or "…"
+            self._last_edit = time.monotonic()
+        await self._show(self.current)
+
+    async def _show(self, raw: str, force: bool = False):
+        content = self._content(raw)
+        if not content.strip() or content == self._shown:
+            return
+        if not force and time.monotonic() - self._last_edit < self.min_interval:
+            return
+        await self.messages[-1].edit(content=content)
+        self._shown = content
+        self._last_edit = time.monotonic()
+
+    async def finish(self) -> str:
+        """Flush the last edit and return the full raw text."""
+        if not self.messages:
+            await self.start()
+        await self._show(self.current, force=True)
+        return self.text